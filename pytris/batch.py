@@ -0,0 +1,185 @@
+import numpy as np
+import game
+from typing import Optional
+
+# rows kept above the visible board, enough for pieces spawned or kicked there
+HIDDEN = 8
+
+# row offsets and bitmasks for each piece and rotation, relative to the left of
+# the bounding box, padded to four rows by repeating the last row so that
+# every piece can be placed with the same array operations
+MASK_ROWS = np.zeros((len(game.pieces), 4, 4), dtype=np.int64)
+MASK_BITS = np.zeros((len(game.pieces), 4, 4), dtype=np.int64)
+BOUNDS = np.zeros((len(game.pieces), 4, 4), dtype=np.int64)
+for p, piece_type in enumerate(game.pieces):
+    for r in range(4):
+        masks = list(piece_type.masks[r])
+        masks += [masks[-1]] * (4 - len(masks))
+        MASK_ROWS[p, r] = [dy for dy, mask in masks]
+        MASK_BITS[p, r] = [mask for dy, mask in masks]
+        BOUNDS[p, r] = piece_type.bounds[r]
+
+# score tables indexed by spin type value and lines cleared, padded to five
+# entries so they can be indexed by any line count
+SCORES = np.array([list(scores) + [scores[-1]] * (5 - len(scores)) for spin_type, scores in sorted(game.SCORES.items(), key=lambda item: item[0].value)], dtype=np.int64)
+ALL_CLEAR_SCORES = np.array(game.ALL_CLEAR_SCORES, dtype=np.int64)
+
+class BatchGame:
+    # N independent boards stepped in lockstep, with each board stored as a
+    # row of bitmasks like bitboard.Board. Colours, pieces and timing are left
+    # to the caller, which chooses where each piece is placed. Garbage sent is
+    # counted, and received garbage is queued in pending for cancelling until a
+    # placement which clears nothing empties the queue, as in Game.lock_piece.
+    # The caller then adds its rows with push_garbage, choosing the holes.
+    rows: np.ndarray
+    b2b: np.ndarray
+    combo: np.ndarray
+    score: np.ndarray
+    lines: np.ndarray
+    level: np.ndarray
+    sent: np.ndarray
+    pending: np.ndarray
+    alive: np.ndarray
+
+    def __init__(self, n: int, config: Optional[game.GameConfig] = None) -> None:
+        if config is None:
+            config = game.GameConfig()
+        self.n = n
+        self.config = config
+        self.width = config.width
+        self.height = config.height
+        self.full_row = (1 << config.width) - 1
+        self.rows = np.zeros((n, HIDDEN + config.height), dtype=np.int64)
+        self.b2b = np.zeros(n, dtype=np.int64)
+        self.combo = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.lines = np.zeros(n, dtype=np.int64)
+        self.level = np.ones(n, dtype=np.int64)
+        self.sent = np.zeros(n, dtype=np.int64)
+        self.pending = np.zeros(n, dtype=np.int64)
+        self.alive = np.ones(n, dtype=bool)
+
+    def load(self, i: int, x: game.Game) -> None:
+        # copy the board and counters of a scalar game into board i
+        board = x.board
+        if board.hidden > HIDDEN:
+            raise ValueError("board is too tall to load")
+        self.rows[i] = 0
+        self.rows[i, HIDDEN - board.hidden:] = board.rows
+        self.b2b[i] = x.b2b
+        self.combo[i] = x.combo
+        self.score[i] = x.score
+        self.lines[i] = x.lines
+        self.level[i] = x.level
+        self.sent[i] = 0
+        self.pending[i] = sum(x.garbage_queue)
+        self.alive[i] = x.death_ticks is None
+
+    def collisions(self, piece: np.ndarray, rotation: np.ndarray, x: np.ndarray) -> np.ndarray:
+        # (N, rows + 1) array of whether each piece collides when the top of
+        # its shape is at each row, with the floor as filled rows below
+        n, total = self.rows.shape
+        left = BOUNDS[piece, rotation, 0]
+        if (x + left < 0).any() or (x + BOUNDS[piece, rotation, 2] >= self.width).any():
+            raise ValueError("piece placed outside the board")
+        padded = np.concatenate((self.rows, np.full((n, 4), self.full_row, dtype=np.int64)), axis=1)
+        positions = np.arange(total + 1)
+        collides = np.zeros((n, total + 1), dtype=bool)
+        shift = (x + left)[:, None]
+        for k in range(4):
+            index = positions[None, :] + MASK_ROWS[piece, rotation, k][:, None]
+            collides |= (np.take_along_axis(padded, index, axis=1) & (MASK_BITS[piece, rotation, k][:, None] << shift)) != 0
+        return collides
+
+    def drop(self, piece: np.ndarray, rotation: np.ndarray, x: np.ndarray, y: int = -2) -> np.ndarray:
+        # y each piece lands at when hard dropped from y, without any tucks.
+        # Boards where the piece doesn't fit at y are marked as dead.
+        collides = self.collisions(piece, rotation, x)
+        start = y + HIDDEN
+        self.alive &= ~collides[:, start]
+        collides[:, :start + 1] = False
+        return np.argmax(collides, axis=1) - 1 - HIDDEN
+
+    def place(self, piece: np.ndarray, rotation: np.ndarray, x: np.ndarray, y: np.ndarray, spin: np.ndarray, *, active: Optional[np.ndarray] = None) -> np.ndarray:
+        # lock a piece on every active board and apply the same rules as
+        # Game.lock_piece, returning the number of lines cleared on each board
+        if active is None:
+            active = self.alive
+        index = np.flatnonzero(active)
+        piece = np.asarray(piece)[index]
+        rotation = np.asarray(rotation)[index]
+        x = np.asarray(x)[index]
+        y = np.asarray(y)[index]
+        spin = np.asarray(spin)[index]
+        if (y + BOUNDS[piece, rotation, 1] < -HIDDEN).any():
+            raise ValueError("piece placed above the hidden rows")
+
+        # place pieces, where repeated mask rows set the same bits twice
+        rows = self.rows[index]
+        shift = (x + BOUNDS[piece, rotation, 0])[:, None]
+        board_index = np.arange(len(index))[:, None]
+        row_index = y[:, None] + HIDDEN + MASK_ROWS[piece, rotation]
+        rows[board_index, row_index] |= MASK_BITS[piece, rotation] << shift
+
+        # clear lines by moving full rows to the top with a stable sort and emptying them
+        full = rows == self.full_row
+        cleared = full.sum(axis=1)
+        order = np.argsort(~full, axis=1, kind="stable")
+        rows = np.take_along_axis(rows, order, axis=1)
+        rows[np.arange(rows.shape[1])[None, :] < cleared[:, None]] = 0
+        self.rows[index] = rows
+
+        # check all clear, b2b, combo
+        all_clear = ~rows.any(axis=1)
+        b2b = self.b2b[index]
+        combo = self.combo[index]
+        has_spin = spin != game.SpinType.NONE.value
+        b2b = np.where(has_spin | (cleared == 4), b2b + (cleared > 0), np.where(cleared > 0, 0, b2b))
+        combo = np.where(cleared > 0, combo + 1, 0)
+
+        # send and cancel garbage
+        lines = np.where(spin == game.SpinType.SPIN.value, cleared * 2, np.where(cleared == 4, 4, cleared - 1))
+        lines += all_clear * 5 + (b2b > 1)
+        combo_lines = np.where(lines == 0, np.floor(np.log(1 + 1.25 * (combo - 1).clip(0))), np.floor(lines * (1 + 0.25 * (combo - 1)))).astype(np.int64)
+        lines = np.where(combo > 1, combo_lines, lines)
+        lines = np.where(cleared > 0, lines, 0)
+        pending = self.pending[index]
+        if self.config.garbage_cancelling:
+            cancelled = np.minimum(lines, pending)
+            pending = pending - cancelled
+            lines -= cancelled
+        self.sent[index] += lines
+
+        # garbage still queued is received by placements which clear nothing,
+        # though its rows are left for the caller to add
+        self.pending[index] = np.where(cleared > 0, pending, 0)
+
+        # add score
+        multiplier = SCORES[spin, cleared]
+        multiplier += np.where(combo > 1, (combo - 1) * 50, 0)
+        multiplier += np.where(all_clear, np.where(b2b > 1, game.B2B_ALL_CLEAR_SCORE, ALL_CLEAR_SCORES[cleared]), 0)
+        multiplier = np.where((b2b > 1) & (cleared > 0), multiplier * 3 // 2, multiplier)
+        self.score[index] += multiplier * self.level[index]
+        self.lines[index] += cleared
+        self.level[index] = self.lines[index] // 10 + 1
+        self.b2b[index] = b2b
+        self.combo[index] = combo
+
+        result = np.zeros(self.n, dtype=np.int64)
+        result[index] = cleared
+        return result
+
+    def push_garbage(self, counts: np.ndarray, holes: np.ndarray) -> None:
+        # add counts[i] rows at the bottom of board i with an empty cell in
+        # column holes[i], moving everything else up, as Game.lock_piece does
+        # for each entry in its garbage queue. Boards with blocks pushed out
+        # of the hidden rows are marked as dead.
+        counts = np.asarray(counts)
+        holes = np.asarray(holes)
+        n, total = self.rows.shape
+        positions = np.arange(total)[None, :]
+        self.alive &= ~((positions < counts[:, None]) & (self.rows != 0)).any(axis=1)
+        source = positions + counts[:, None]
+        rows = np.take_along_axis(self.rows, np.minimum(source, total - 1), axis=1)
+        garbage = (self.full_row & ~(np.int64(1) << holes))[:, None]
+        self.rows = np.where(source < total, rows, garbage)
@@ -0,0 +1,413 @@
+import random, time, os, io, importlib.util
+import game, null_ui, ui, movegen, bot, rotation, multiplayer, replay
+from typing import List, Tuple
+
+MOVES = [game.Key.LEFT, game.Key.RIGHT, game.Key.SOFT_DROP, game.Key.CLOCKWISE, game.Key.ANTICLOCKWISE, game.Key.ROTATE_180, game.Key.HOLD]
+
+def new_game(seed: int) -> game.Game:
+    random.seed(seed)
+    x = game.Game(game.GameConfig(), game.BagRandomiser(1, 0), {key: key.name for key in game.Key})
+    null_ui.NullUI().push_menu(x)
+    x.countdown = 0
+    return x
+
+def random_inputs(rng: random.Random) -> List[game.Key]:
+    inputs = [rng.choice(MOVES) for i in range(rng.randint(0, 2))]
+    if rng.random() < 0.1:
+        inputs.append(game.Key.HARD_DROP)
+    return inputs
+
+def report(name: str, count: float, unit: str, elapsed: float) -> None:
+    print(f"{name}: {count / elapsed:.0f} {unit}/s")
+
+def bench_headless(duration: float) -> None:
+    rng = random.Random(0)
+    ticks = pieces = 0
+    elapsed = 0.0
+    seed = 0
+    while elapsed < duration:
+        x = new_game(seed)
+        seed += 1
+        inputs = [random_inputs(rng) for i in range(10000)]
+        start = time.perf_counter()
+        for keys in inputs:
+            if not x.step(keys):
+                break
+        elapsed += time.perf_counter() - start
+        ticks += x.ticks
+        pieces += x.pieces_placed
+    report("headless", ticks, "ticks", elapsed)
+    report("headless", pieces, "pieces", elapsed)
+
+def bench_snapshot(duration: float) -> None:
+    # take snapshots of a game part way through, with a partly filled board
+    rng = random.Random(0)
+    x = new_game(0)
+    for i in range(2000):
+        if not x.step(random_inputs(rng)):
+            break
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration / 2:
+        for i in range(1000):
+            state = x.snapshot()
+        count += 1000
+    report("snapshot", count, "snapshots", time.perf_counter() - start)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration / 2:
+        for i in range(1000):
+            x.restore(state)
+        count += 1000
+    report("snapshot", count, "restores", time.perf_counter() - start)
+
+def random_placement(x: game.Game, rng: random.Random, tries: int = 16) -> None:
+    # drop the current piece at the best of a few random rotations and
+    # columns, preferring line clears and then low placements, and sometimes
+    # treat the last move as a rotation so spins can happen
+    piece = x.current_piece
+    board = x.board
+    best = None
+    for i in range(tries):
+        piece.reset()
+        piece.rotation = rng.randrange(4)
+        left, top, right, bottom = piece.base.bounds[piece.rotation]
+        piece.x = rng.randint(-left, x.config.width - 1 - right)
+        if piece.intersect():
+            continue
+        piece.y += piece.drop_distance()
+        shift = piece.x + left
+        cleared = sum(board.row(piece.y + dy) | (mask << shift) == board.full_row for dy, mask in piece.base.masks[piece.rotation])
+        if best is None or (cleared, piece.y + top) > best[0]:
+            best = ((cleared, piece.y + top), piece.rotation, piece.x, piece.y)
+    if best is None:
+        piece.reset()
+        piece.y += piece.drop_distance()
+    else:
+        _, piece.rotation, piece.x, piece.y = best
+    piece.rotation_last = rng.random() < 0.3
+    piece.last_kick = rng.choice((0, 4))
+
+def check_batch(n: int = 256, placements: int = 300) -> None:
+    # place the same pieces on scalar games and a batch, checking that they
+    # agree after every placement. Games are sent garbage, which the batch
+    # adds with the same holes as each game's random generator chooses.
+    import batch, numpy as np
+    rng = random.Random(0)
+    games = []
+    counters = []
+    for seed in range(n):
+        x = new_game(seed)
+        x.set_spins(game.SpinType.SPIN, game.SpinType.MINI, game.SpinType.SPIN, game.SpinType.SPIN)
+        counters.append(bot.GarbageCounter())
+        x.set_connection(counters[-1])
+        # start with a well of garbage so that quads and all clears happen
+        hole = rng.randrange(x.config.width)
+        lines = rng.randint(0, 4)
+        x.board.push_rows([x.board.full_row & ~(1 << hole)] * lines, bytes([ui.Colour.DARK_GREY.value]) * x.config.width * lines)
+        for i in range(rng.randint(0, 2)):
+            x.receive_garbage(rng.randint(1, 4))
+        games.append(x)
+    b = batch.BatchGame(n, games[0].config)
+    for i, x in enumerate(games):
+        b.load(i, x)
+    checked = 0
+    for turn in range(placements):
+        alive = np.array([x.death_ticks is None for x in games])
+        if not alive.any():
+            break
+        move = np.zeros((5, n), dtype=np.int64)
+        # the garbage queue entries each game adds to its board, with their holes
+        received: List[List[Tuple[int, int]]] = [[] for x in games]
+        for i, x in enumerate(games):
+            if not alive[i]:
+                continue
+            if rng.random() < 0.1:
+                lines = rng.randint(1, 4)
+                x.receive_garbage(lines)
+                b.pending[i] += lines
+            lines = x.lines
+            queue = list(x.garbage_queue)
+            hole_rng = random.Random()
+            hole_rng.setstate(x.rng.getstate())
+            random_placement(x, rng)
+            piece = x.current_piece
+            rotation_last = piece.rotation_last
+            spin = x.detect_spin(piece)
+            piece.rotation_last = rotation_last
+            move[:, i] = (game.pieces.index(piece.base), piece.rotation, piece.x, piece.y, spin.value)
+            x.lock_piece()
+            if x.lines == lines:
+                received[i] = [(count, hole_rng.randint(0, x.config.width - 1)) for count in queue]
+        b.place(*move, active=alive)
+        for entry in range(max(len(queue) for queue in received)):
+            counts = np.array([queue[entry][0] if entry < len(queue) else 0 for queue in received])
+            holes = np.array([queue[entry][1] if entry < len(queue) else 0 for queue in received])
+            b.push_garbage(counts, holes)
+        for i, x in enumerate(games):
+            if not alive[i]:
+                continue
+            rows = [int(row) for row in b.rows[i]]
+            hidden = batch.HIDDEN - x.board.hidden
+            expected = (x.b2b, x.combo, x.score, x.lines, x.level, counters[i].sent, sum(x.garbage_queue))
+            actual = (b.b2b[i], b.combo[i], b.score[i], b.lines[i], b.level[i], b.sent[i], b.pending[i])
+            if rows[hidden:] != x.board.rows or any(rows[:hidden]) or expected != actual:
+                raise AssertionError(f"batch differs from game {i} after {turn+1} placements: {actual} != {expected}")
+            checked += 1
+    print(f"batch: {checked} placements match, {sum(x.lines for x in games)} lines cleared")
+
+def bench_batch(duration: float, n: int = 4096) -> None:
+    import batch, numpy as np
+    rng = np.random.default_rng(0)
+    count = 0
+    elapsed = 0.0
+    while elapsed < duration:
+        b = batch.BatchGame(n)
+        start = time.perf_counter()
+        for i in range(100):
+            piece = rng.integers(len(game.pieces), size=n)
+            rotation = rng.integers(4, size=n)
+            left = batch.BOUNDS[piece, rotation, 0]
+            right = batch.BOUNDS[piece, rotation, 2]
+            x = rng.integers(-left, b.width - right)
+            y = b.drop(piece, rotation, x)
+            count += b.alive.sum()
+            b.place(piece, rotation, x, y, np.zeros(n, dtype=np.int64))
+        elapsed += time.perf_counter() - start
+    report("batch", count, "placements", elapsed)
+
+def random_positions(count: int) -> List[game.Game]:
+    # games part way through with rough stacks, which have lots of tucks
+    rng = random.Random(0)
+    games: List[game.Game] = []
+    seed = 0
+    while len(games) < count:
+        x = new_game(seed)
+        seed += 1
+        for i in range(rng.randint(5, 40)):
+            random_placement(x, rng, tries=2)
+            x.lock_piece()
+            if x.death_ticks is not None:
+                break
+        else:
+            games.append(x)
+    return games
+
+class ReplayBuffer(io.BytesIO):
+    # a recording which can still be read after the recorder closes it
+    def close(self) -> None:
+        self.seek(0)
+
+def check_replay(count: int = 30, ticks: int = 3000) -> None:
+    # record games with every garbage type and rotation system, then play
+    # them back and check that they end the same way
+    rng = random.Random(0)
+    for i in range(count):
+        config = game.GameConfig()
+        config.garbage_type = game.GarbageType(i % len(game.GarbageType))
+        config.rotation_system = rotation.NAMES[i % len(rotation.NAMES)]
+        x = game.Game(config, game.BagRandomiser(1, 0), {key: key.name for key in game.Key}, seed=i)
+        connection = None
+        if i % 3 == 0:
+            connection = replay.ReplayConnection()
+            x.set_connection(connection)
+        stream = ReplayBuffer()
+        x.set_recorder(replay.ReplayRecorder(stream, x))
+        null_ui.NullUI().push_menu(x)
+        for tick in range(ticks):
+            if connection is not None and rng.random() < 0.01:
+                connection.messages.append((multiplayer.CMD_RECEIVE_GARBAGE, bytes([rng.randint(1, 4)])))
+            if not x.step(random_inputs(rng)):
+                break
+        else:
+            x.press(game.Key.FORFEIT)
+        player = replay.ReplayPlayer(replay.Replay(stream))
+        while not player.finished():
+            player.step()
+        y = player.game
+        expected = (x.board.rows, x.score, x.lines, x.frames)
+        actual = (y.board.rows, y.score, y.lines, y.frames)
+        if expected != actual:
+            raise AssertionError(f"replay {i} differs after playback: {actual[1:]} != {expected[1:]}")
+    print(f"replay: {count} games match")
+
+def check_movegen(count: int = 100) -> None:
+    # play every placement's keys and check that the piece locks where expected
+    checked = 0
+    for x in random_positions(count):
+        state = x.snapshot()
+        seen = set()
+        for placement in movegen.placements(x):
+            x.restore(state)
+            x.no_hard_drop_ticks = 0
+            for key in placement.keys[:-1]:
+                x.press(key)
+            piece = x.current_piece
+            distance = piece.drop_distance()
+            cells = {(piece.x + dx, piece.y + distance + dy) for dx, dy in piece.base.cells[piece.rotation]}
+            spin = x.detect_spin(piece) if distance == 0 else game.SpinType.NONE
+            expected = {(placement.x + dx, placement.y + dy) for dx, dy in piece.base.cells[placement.rotation]}
+            if cells != expected or spin != placement.spin:
+                raise AssertionError(f"{placement} locks at {sorted(cells)} with {spin}")
+            if (frozenset(cells), spin) in seen:
+                raise AssertionError(f"{placement} is a duplicate")
+            seen.add((frozenset(cells), spin))
+            checked += 1
+    print(f"movegen: {checked} placements match")
+
+def bench_movegen(duration: float) -> None:
+    games = random_positions(50)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for x in games:
+            movegen.placements(x)
+        count += len(games)
+    report("movegen", count, "boards", time.perf_counter() - start)
+
+def bench_rotation(duration: float) -> None:
+    # rotate pieces in random places on partly filled boards, where some
+    # rotations need kicks and some fail
+    rng = random.Random(0)
+    games = random_positions(20)
+    states = []
+    for x in games:
+        for i in range(50):
+            piece = game.Piece(rng.choice(game.pieces), x)
+            piece.x = rng.randint(0, x.config.width - 3)
+            piece.y = rng.randint(-2, x.config.height - 4)
+            piece.rotation = rng.randrange(4)
+            if not piece.intersect():
+                states.append((piece, piece.get_state(), rng.choice((1, -1, 2))))
+    for name in rotation.NAMES:
+        for x in games:
+            x.rotation_system = game.rotation_systems[name]
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration / len(rotation.NAMES):
+            for piece, state, change in states:
+                piece.set_state(state)
+                piece.rotate(change)
+            count += len(states)
+        report(f"rotation {name}", count, "rotations", time.perf_counter() - start)
+
+def bench_bot(duration: float, depth: int) -> None:
+    pieces = 0
+    elapsed = 0.0
+    seed = 0
+    while elapsed < duration:
+        x = new_game(seed)
+        seed += 1
+        start = time.perf_counter()
+        bot.play(x, bot.Bot(depth=depth, pieces_per_second=0), pieces=100)
+        elapsed += time.perf_counter() - start
+        pieces += x.pieces_placed
+    report(f"bot depth {depth}", pieces, "pieces", elapsed)
+
+def terminal_game(seed: int) -> game.Game:
+    # a game drawn in the terminal UI, writing to the null device
+    import terminal_ui
+    main_ui = terminal_ui.TerminalUI()
+    main_ui.width = 40
+    main_ui.height = 32
+    main_ui.writer = terminal_ui.Writer(os.open(os.devnull, os.O_WRONLY))
+    x = new_game(seed)
+    x.init(main_ui)
+    return x
+
+def bench_redraw(duration: float) -> None:
+    # draw a game part way through from scratch, as after resizing
+    import terminal_ui
+    rng = random.Random(0)
+    x = terminal_game(0)
+    main_ui = x.ui.backend
+    assert isinstance(main_ui, terminal_ui.TerminalUI)
+    for i in range(2000):
+        if not x.step(random_inputs(rng)):
+            break
+    count = written = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration / 2:
+        main_ui.front_size = (0, 0) # forget what is on screen
+        x.resize(main_ui.width, main_ui.height)
+        count += 1
+        written += main_ui.frame_bytes
+    report("redraw", count, "full redraws", time.perf_counter() - start)
+    print(f"redraw: {written / count:.0f} bytes per full redraw")
+    # then play games with everything drawn as it changes
+    ticks = pieces = 0
+    written = 0
+    elapsed = 0.0
+    seed = 0
+    while elapsed < duration / 2:
+        x = terminal_game(seed)
+        main_ui = x.ui.backend
+        assert isinstance(main_ui, terminal_ui.TerminalUI)
+        seed += 1
+        inputs = [random_inputs(rng) for i in range(2000)]
+        written -= main_ui.bytes_written
+        start = time.perf_counter()
+        for keys in inputs:
+            if not x.step(keys):
+                break
+        elapsed += time.perf_counter() - start
+        written += main_ui.bytes_written
+        ticks += x.ticks
+        pieces += x.pieces_placed
+    report("drawn", ticks, "ticks", elapsed)
+    print(f"drawn: {written / max(1, pieces):.0f} bytes per piece")
+
+def random_frames(rng: random.Random, count: int) -> List[bytes]:
+    # mostly one byte garbage messages, with the odd longer one
+    frames = []
+    for i in range(count):
+        data = bytes(rng.randrange(256) for j in range(1 if rng.random() < 0.9 else rng.randrange(300)))
+        frames.append(bytes([multiplayer.CMD_SEND_GARBAGE, len(data) >> 8, len(data) & 0xFF]) + data)
+    return frames
+
+def check_framing(count: int = 2000) -> None:
+    # frames must come out the same however the stream is split up
+    rng = random.Random(0)
+    frames = random_frames(rng, count)
+    stream = b"".join(frames)
+    buffer = multiplayer.FrameBuffer()
+    parsed = []
+    i = 0
+    while i < len(stream):
+        n = rng.choice((1, 2, 3, 7, 100, 5000))
+        buffer.feed(stream[i:i+n])
+        parsed += buffer.parse()
+        i += n
+    assert [bytes([command]) + bytes([len(data) >> 8, len(data) & 0xFF]) + data for command, data in parsed] == frames
+    print(f"framing: {len(parsed)} frames match")
+
+def bench_framing(duration: float) -> None:
+    # parsing many small frames arriving together, as a busy server would
+    stream = b"".join(random_frames(random.Random(0), 10000))
+    chunks = [stream[i:i+multiplayer.RECV_SIZE] for i in range(0, len(stream), multiplayer.RECV_SIZE)]
+    buffer = multiplayer.FrameBuffer()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for chunk in chunks:
+            buffer.feed(chunk)
+            count += len(buffer.parse())
+    report("framing", count, "frames", time.perf_counter() - start)
+
+def run(duration: float = 2.0) -> None:
+    bench_headless(duration)
+    bench_snapshot(duration)
+    bench_redraw(duration)
+    bench_rotation(duration)
+    check_replay()
+    check_framing()
+    bench_framing(duration)
+    check_movegen()
+    bench_movegen(duration)
+    bench_bot(duration, 1)
+    bench_bot(duration, 2)
+    if importlib.util.find_spec("numpy") is not None:
+        check_batch()
+        bench_batch(duration)
+    else:
+        print("batch: numpy is not installed")
@@ -0,0 +1,192 @@
+import ui
+from typing import List, Iterator, Sequence, Tuple, Union
+
+COLOURS = tuple(ui.Colour) # indexed by colour value
+
+class Board:
+    # Each row is stored as an occupancy bitmask (bit x set if column x is filled)
+    # alongside a flat bytearray of colour values, one row after another. Rows
+    # above the visible board are kept in the hidden rows at the start. tops
+    # holds the y of the highest filled cell in each column, or the board
+    # height if it is empty.
+    rows: List[int]
+    colours: bytearray
+    tops: List[int]
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.full_row = (1 << width) - 1
+        self.hidden = 0
+        self.rows = [0] * height
+        self.colours = bytearray(width * height)
+        self.tops = [height] * width
+
+    def get_state(self) -> Tuple[Tuple[int, ...], bytes, int, Tuple[int, ...]]:
+        return (tuple(self.rows), bytes(self.colours), self.hidden, tuple(self.tops))
+
+    def set_state(self, state: Tuple[Tuple[int, ...], bytes, int, Tuple[int, ...]]) -> None:
+        rows, colours, self.hidden, tops = state
+        self.rows = list(rows)
+        self.colours = bytearray(colours)
+        self.tops = list(tops)
+
+    def row(self, y: int) -> int:
+        i = y + self.hidden
+        if i < 0:
+            return 0
+        return self.rows[i]
+
+    def get(self, x: int, y: int) -> bool:
+        if y >= self.height:
+            return True
+        if not 0 <= x < self.width:
+            return True
+        return (self.row(y) >> x) & 1 == 1
+
+    def colour(self, x: int, y: int) -> ui.Colour:
+        i = y + self.hidden
+        if i < 0:
+            return ui.Colour.BLACK
+        return COLOURS[self.colours[i * self.width + x]]
+
+    def set(self, x: int, y: int, colour: ui.Colour) -> None:
+        self.place(y, 1 << x, colour)
+
+    def place(self, y: int, mask: int, colour: ui.Colour) -> None:
+        self.grow(y)
+        i = y + self.hidden
+        self.rows[i] |= mask
+        colours = self.colours
+        start = i * self.width
+        tops = self.tops
+        value = colour.value
+        while mask:
+            bit = mask & -mask
+            x = bit.bit_length() - 1
+            colours[start + x] = value
+            if y < tops[x]:
+                tops[x] = y
+            mask ^= bit
+
+    def collides(self, x: int, y: int, masks: Sequence[Tuple[int, int]], bounds: Tuple[int, int, int, int]) -> bool:
+        # masks are (row offset, bitmask) pairs relative to the left of the bounding box
+        left, top, right, bottom = bounds
+        if x + left < 0 or x + right >= self.width or y + bottom >= self.height:
+            return True
+        shift = x + left
+        i = y + self.hidden
+        rows = self.rows
+        for dy, mask in masks:
+            if i + dy >= 0 and rows[i + dy] & (mask << shift):
+                return True
+        return False
+
+    def drop_distance(self, x: int, y: int, bottoms: Sequence[Tuple[int, int]], masks: Sequence[Tuple[int, int]], bounds: Tuple[int, int, int, int]) -> int:
+        # bottoms are the (column offset, row offset) of the lowest cell in each piece column
+        tops = self.tops
+        distance = self.height - y
+        for dx, dy in bottoms:
+            d = tops[x + dx] - y - dy - 1
+            if d < 0:
+                # piece is tucked under the surface, so check each row
+                distance = 0
+                while not self.collides(x, y + distance + 1, masks, bounds):
+                    distance += 1
+                return distance
+            if d < distance:
+                distance = d
+        return distance
+
+    def clear_lines(self) -> List[int]:
+        full_row = self.full_row
+        full = [i - self.hidden for i, row in enumerate(self.rows) if row == full_row]
+        if full:
+            n = len(full)
+            kept = [i for i, row in enumerate(self.rows) if row != full_row]
+            width = self.width
+            colours = self.colours
+            self.rows = [0] * n + [self.rows[i] for i in kept]
+            self.colours = bytearray(n * width) + b"".join(colours[i*width:(i+1)*width] for i in kept)
+            self.trim()
+            self.update_tops()
+        return full
+
+    def push_rows(self, masks: Sequence[int], colours: Union[bytes, bytearray]) -> None:
+        # add rows at the bottom in order, moving every other row up
+        n = len(masks)
+        self.rows.extend(masks)
+        self.colours += colours
+        self.hidden += n
+        tops = self.tops
+        height = self.height
+        empty = 0
+        for x in range(self.width):
+            if tops[x] < height:
+                tops[x] -= n
+            else:
+                empty |= 1 << x
+        for i, mask in enumerate(masks):
+            found = mask & empty
+            while found:
+                bit = found & -found
+                tops[bit.bit_length() - 1] = height - n + i
+                found ^= bit
+            empty &= ~mask
+        self.trim()
+
+    def rise_distance(self, x: int, y: int, masks: Sequence[Tuple[int, int]], bounds: Tuple[int, int, int, int], new_rows: Sequence[int]) -> int:
+        # how far a piece is pushed up when new_rows are added one at a time,
+        # where it moves up whenever it overlaps the board. Once it overlaps,
+        # every later row pushes it up again.
+        shift = x + bounds[0]
+        height = self.height
+        n = len(new_rows)
+        for k in range(1, n + 1):
+            for dy, mask in masks:
+                row = y + dy + k
+                if row < height:
+                    cells = self.row(row)
+                else:
+                    cells = new_rows[row - height]
+                if cells & (mask << shift):
+                    return n - k + 1
+        return 0
+
+    def is_empty(self) -> bool:
+        return not any(self.rows)
+
+    def filled_rows(self) -> Iterator[Tuple[int, bytearray]]:
+        width = self.width
+        for i, row in enumerate(self.rows):
+            if row:
+                yield i - self.hidden, self.colours[i*width:(i+1)*width]
+
+    def update_tops(self) -> None:
+        tops = [self.height] * self.width
+        remaining = self.full_row
+        for i, row in enumerate(self.rows):
+            found = row & remaining
+            while found:
+                bit = found & -found
+                tops[bit.bit_length() - 1] = i - self.hidden
+                found ^= bit
+            remaining &= ~row
+            if not remaining:
+                break
+        self.tops = tops
+
+    def grow(self, y: int) -> None:
+        while y + self.hidden < 0:
+            self.rows.insert(0, 0)
+            self.colours[0:0] = bytes(self.width)
+            self.hidden += 1
+
+    def trim(self) -> None:
+        n = 0
+        while n < self.hidden and self.rows[n] == 0:
+            n += 1
+        if n:
+            del self.rows[:n]
+            del self.colours[:n * self.width]
+            self.hidden -= n
@@ -0,0 +1,303 @@
+import copy, time, concurrent.futures, multiprocessing
+import game, movegen, multiplayer, null_ui
+from typing import List, Optional, Tuple, Dict
+
+class Weights:
+    def __init__(self) -> None:
+        # board shape, scored once the search reaches its last piece
+        self.holes = -6.0
+        self.bumpiness = -0.4
+        self.height = -0.15
+        self.danger = -1.0 # per row above half the board height, squared
+        self.well = 0.6 # per row of the deepest well, up to four
+        # rewards for each placement on the way there
+        self.attack = 2.0 # per line of garbage sent
+        self.clears = (0.0, -1.5, -1.0, -0.5, 0.0) # to save lines for quads and spins
+        self.spin = 1.5
+        self.b2b = 1.0 # for keeping a back to back chain going
+        self.combo = 0.3
+
+class GarbageCounter(multiplayer.Connection):
+    # counts garbage sent by a simulated game
+    def __init__(self) -> None:
+        self.sent = 0
+    def send(self, command: int, data: bytes) -> None:
+        if command == multiplayer.CMD_SEND_GARBAGE:
+            self.sent += int.from_bytes(data, "big")
+    def recv(self) -> List[Tuple[int, bytes]]:
+        return []
+    def close(self) -> None:
+        pass
+
+# everything needed to build a simulation of a game, which can be sent to other processes
+Setup = Tuple[game.GameConfig, Tuple[game.SpinType, ...], game.Randomiser]
+
+# whether to hold first, and where to place the piece
+Plan = Tuple[bool, movegen.Placement]
+
+# reward, board value, plan and state after placing it
+Candidate = Tuple[float, float, Plan, game.GameState]
+
+# which piece a search is for, so it can be dropped once that piece is placed or held
+Position = Tuple[int, bool]
+
+# a search running in the worker processes, as the piece it is for, where
+# that piece was when it started, the placements being searched and their results
+Search = Tuple[Position, Tuple[game.PieceType, int, int, int, bool, int], List[Candidate], List["concurrent.futures.Future[float]"]]
+
+def position(x: game.Game) -> Position:
+    return (x.pieces_placed, x.held)
+
+def get_setup(x: game.Game) -> Setup:
+    return (x.config, (x.t_spin, x.mini_t_spin, x.immobile_t, x.all_spin), copy.deepcopy(x.randomiser))
+
+def simulate(setup: Setup) -> game.Game:
+    # a headless game which keeps track of the garbage it sends
+    config, spins, randomiser = setup
+    x = game.Game(config, copy.deepcopy(randomiser), {key: key.name for key in game.Key}, seed=0)
+    x.set_spins(*spins)
+    x.set_connection(GarbageCounter())
+    x.init(null_ui.NullUI())
+    return x
+
+def popcount(n: int) -> int:
+    return bin(n).count("1")
+
+def evaluate(x: game.Game, weights: Weights) -> float:
+    board = x.board
+    heights = [board.height - top for top in board.tops]
+    holes = 0
+    covered = 0
+    for row in board.rows:
+        holes += popcount(covered & ~row)
+        covered |= row
+    bumpiness = sum(abs(heights[i] - heights[i+1]) for i in range(len(heights) - 1))
+    well = 0
+    for i, h in enumerate(heights):
+        left = heights[i-1] if i > 0 else board.height
+        right = heights[i+1] if i < len(heights) - 1 else board.height
+        well = max(well, min(left, right, h + 4) - h)
+    danger = max(0, max(heights) - board.height // 2)
+    return (weights.holes * holes + weights.bumpiness * bumpiness + weights.height * sum(heights)
+        + weights.danger * danger * danger + weights.well * well)
+
+def reward(x: game.Game, lines: int, sent: int, spin: game.SpinType, weights: Weights) -> float:
+    # value of a placement which has just cleared lines and sent garbage
+    value = weights.attack * sent + weights.clears[lines] + weights.combo * x.combo
+    if lines > 0 and spin != game.SpinType.NONE:
+        value += weights.spin
+    if x.b2b > 0:
+        value += weights.b2b
+    return value
+
+def candidates(x: game.Game, weights: Weights) -> List[Candidate]:
+    # every placement of the current piece, with and without holding
+    state = x.snapshot()
+    counter = x.connection
+    assert isinstance(counter, GarbageCounter)
+    holds = [False]
+    if x.config.hold_type != game.HoldType.NONE and not x.held:
+        holds.append(True)
+    result = []
+    for hold in holds:
+        x.restore(state)
+        if hold:
+            x.press(game.Key.HOLD)
+        hold_state = x.snapshot()
+        for placement in movegen.placements(x):
+            x.restore(hold_state)
+            x.no_hard_drop_ticks = 0
+            lines = x.lines
+            sent = counter.sent
+            for key in placement.keys:
+                x.press(key)
+            if x.death_ticks is not None:
+                continue
+            value = reward(x, x.lines - lines, counter.sent - sent, placement.spin, weights)
+            result.append((value, evaluate(x, weights), (hold, placement), x.snapshot()))
+    x.restore(state)
+    return result
+
+def search(x: game.Game, depth: int, weights: Weights, beam: int) -> Tuple[float, Optional[Plan]]:
+    # best total of rewards and final board value over the next depth pieces,
+    # only looking further at the most promising placements of each piece
+    options = candidates(x, weights)
+    if not options:
+        return float("-inf"), None
+    options.sort(key=lambda option: option[0] + option[1], reverse=True)
+    if depth <= 1:
+        value, board_value, plan, state = options[0]
+        return value + board_value, plan
+    best = (float("-inf"), options[0][2])
+    for value, board_value, plan, state in options[:beam]:
+        x.restore(state)
+        value += search(x, depth - 1, weights, beam)[0]
+        if value > best[0]:
+            best = (value, plan)
+    return best
+
+def search_state(setup: Setup, state: game.GameState, depth: int, weights: Weights, beam: int) -> float:
+    # run in worker processes, which rebuild the game from its setup
+    x = simulate(setup)
+    x.restore(state)
+    return search(x, depth, weights, beam)[0]
+
+class Bot:
+    pool: Optional[concurrent.futures.ProcessPoolExecutor]
+    simulation: Optional[game.Game]
+
+    def __init__(self, depth: int = 2, beam: int = 6, workers: int = 0, pieces_per_second: float = 2.0, weights: Optional[Weights] = None) -> None:
+        self.depth = depth
+        self.beam = beam
+        self.workers = workers
+        self.pieces_per_second = pieces_per_second
+        self.weights = Weights() if weights is None else weights
+        self.pool = None
+        self.simulation = None
+        self.setup: Optional[Setup] = None
+        self.searching: Optional[Search] = None
+        self.wait = 0
+
+    def parallel(self) -> bool:
+        # worker processes are forked, since starting them any other way
+        # would run the game again in each of them
+        return self.depth > 1 and self.workers > 1 and "fork" in multiprocessing.get_all_start_methods()
+
+    def start(self) -> None:
+        # Fork the workers now, before a multiplayer connection starts its
+        # threads, since forking a process with other threads can deadlock.
+        # With fork, the pool starts every worker on its first task.
+        if self.pool is None and self.parallel():
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+            self.pool.submit(int).result()
+
+    def prepare(self, x: game.Game) -> game.Game:
+        # the simulation, set to the game's position
+        if self.simulation is None:
+            self.setup = get_setup(x)
+            self.simulation = simulate(self.setup)
+        sim = self.simulation
+        sim.restore(x.snapshot())
+        sim.countdown = 0
+        return sim
+
+    def submit(self, x: game.Game) -> None:
+        # start searching each of the best placements of this piece in a separate process
+        sim = self.prepare(x)
+        assert self.pool is not None and self.setup is not None
+        options = candidates(sim, self.weights)
+        options.sort(key=lambda option: option[0] + option[1], reverse=True)
+        options = options[:self.beam]
+        futures = [self.pool.submit(search_state, self.setup, state, self.depth - 1, self.weights, self.beam) for value, board_value, plan, state in options]
+        self.searching = (position(x), x.current_piece.get_state(), options, futures)
+
+    def collect(self) -> Optional[Plan]:
+        # the best plan from the search, waiting for any results still to come
+        assert self.searching is not None
+        start, piece, options, futures = self.searching
+        self.searching = None
+        if not options:
+            return None
+        values = [value + future.result() for (value, board_value, plan, state), future in zip(options, futures)]
+        return options[values.index(max(values))][2]
+
+    def replan(self, x: game.Game, plan: Plan) -> Optional[Plan]:
+        # keys reaching the same place from where the piece is now, since it
+        # may have fallen while the search was running
+        hold, placement = plan
+        if hold:
+            return plan
+        sim = self.prepare(x)
+        for option in movegen.placements(sim):
+            if (option.x, option.y, option.rotation) == (placement.x, placement.y, placement.rotation):
+                return (hold, option)
+        return None
+
+    def think(self, x: game.Game) -> Optional[Plan]:
+        sim = self.prepare(x)
+        if self.pool is None and x.connection is None:
+            self.start()
+        if self.pool is None:
+            return search(sim, self.depth, self.weights, self.beam)[1]
+        self.submit(x)
+        return self.collect()
+
+    def update(self, x: game.Game, block: bool = True) -> None:
+        # called every tick, playing a piece whenever the game allows it.
+        # Without blocking, a search in the worker processes is checked on
+        # each tick until it finishes instead of being waited for.
+        if x.death_ticks is not None or x.paused or x.countdown:
+            return
+        if self.wait > 0:
+            self.wait -= 1
+            return
+        if x.no_hard_drop_ticks > 0:
+            return
+        if block or self.pool is None:
+            plan = self.think(x)
+        else:
+            if self.searching is not None and self.searching[0] != position(x):
+                # the piece was placed some other way, so the search is out of date
+                for future in self.searching[3]:
+                    future.cancel()
+                self.searching = None
+            if self.searching is None:
+                self.submit(x)
+            assert self.searching is not None
+            if not all(future.done() for future in self.searching[3]):
+                return
+            moved = self.searching[1] != x.current_piece.get_state()
+            plan = self.collect()
+            if plan is not None and moved:
+                plan = self.replan(x, plan)
+                if plan is None:
+                    # it can't get there any more, so search again next tick
+                    return
+        if plan is None:
+            x.press(game.Key.HARD_DROP)
+        else:
+            hold, placement = plan
+            if hold:
+                x.press(game.Key.HOLD)
+            for key in placement.keys:
+                x.press(key)
+        if self.pieces_per_second > 0:
+            self.wait = int(game.TPS / self.pieces_per_second)
+
+    def close(self) -> None:
+        self.searching = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+class BotGame(game.Game):
+    # a game played by a bot, where the player can only pause or forfeit
+    def __init__(self, config: game.GameConfig, randomiser: game.Randomiser, controls: Dict[game.Key, str], bot: Bot, seed: Optional[int] = None) -> None:
+        super().__init__(config, randomiser, controls, seed)
+        self.bot = bot
+        self.bot.start()
+
+    def tick(self) -> None:
+        self.bot.update(self, block=False)
+        super().tick()
+
+    def key(self, c: str, repeated: bool = False) -> None:
+        for action in (game.Key.FORFEIT, game.Key.PAUSE):
+            if c == self.controls[action]:
+                self.press(action, repeated)
+
+    def end_game(self) -> None:
+        super().end_game()
+        self.bot.close()
+
+def play(x: game.Game, bot: Bot, pieces: int = 0, realtime: bool = False) -> None:
+    # play a headless game until it ends or enough pieces are placed, either
+    # as fast as possible or at the normal speed for games against others
+    next_tick = time.perf_counter()
+    while x.death_ticks is None and (pieces <= 0 or x.pieces_placed < pieces):
+        bot.update(x)
+        x.tick()
+        if realtime:
+            next_tick += 1 / game.TPS
+            time.sleep(max(0, next_tick - time.perf_counter()))
+    bot.close()
@@ -28,3 +28,9 @@ def save(name: str, data: Any) -> None:
     path = f"{pytris_folder}/{name}.json"
     with open(path, "w") as f:
         return json.dump(data, f)
+
+def replay_folder() -> str:
+    path = f"{pytris_folder}/replays"
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
@@ -1,6 +1,6 @@
-import random, sys, copy, time, enum, math
-import ui, multiplayer
-from typing import List, Optional, Dict, Tuple
+import random, sys, copy, time, enum, math, operator
+import ui, multiplayer, bitboard, rotation, render
+from typing import List, Optional, Dict, Tuple, Sequence, Any
 
 TPS = 60 # ticks per second
 LOCK_COUNT = 15
@@ -44,6 +44,11 @@ class HoldType(enum.Enum):
     INFINITE = 2
 
 class PieceType:
+    cells: List[Tuple[Tuple[int, int], ...]]
+    bounds: List[Tuple[int, int, int, int]]
+    masks: List[Tuple[Tuple[int, int], ...]]
+    bottoms: List[Tuple[Tuple[int, int], ...]]
+
     def __init__(self, shape: List[List[int]], colour: ui.Colour, name: str) -> None:
         shapes = []
         for i in range(4):
@@ -56,8 +61,30 @@ class PieceType:
         self.shapes = shapes
         self.colour = colour
         self.name = name
+        # occupied cells, bounding boxes and row bitmasks for each rotation
+        self.cells = []
+        self.bounds = []
+        self.masks = []
+        self.bottoms = []
+        for shape in shapes:
+            cells = tuple((x, y) for y, row in enumerate(shape) for x, c in enumerate(row) if c)
+            left = min(x for x, y in cells)
+            right = max(x for x, y in cells)
+            top = min(y for x, y in cells)
+            bottom = max(y for x, y in cells)
+            masks = tuple((y, sum(1 << (x - left) for x in range(left, right+1) if row[x])) for y, row in enumerate(shape) if any(row))
+            self.cells.append(cells)
+            self.bounds.append((left, top, right, bottom))
+            self.masks.append(masks)
+            self.bottoms.append(tuple((x, max(y for cx, y in cells if cx == x)) for x in range(left, right+1)))
+
+    def __reduce__(self) -> Any:
+        # pieces are compared by identity, so pickles refer to the shared piece types
+        return (get_piece_type, (pieces.index(self),))
 
 class Piece:
+    __slots__ = ("base", "game", "name", "x", "y", "rotation", "rotation_last", "last_kick")
+
     def __init__(self, base: PieceType, game: "Game") -> None:
         self.base = base
         self.game = game
@@ -68,11 +95,17 @@ class Piece:
         self.rotation_last = False
         self.last_kick = 0
 
+    def get_state(self) -> Tuple[PieceType, int, int, int, bool, int]:
+        return (self.base, self.x, self.y, self.rotation, self.rotation_last, self.last_kick)
+
+    def set_state(self, state: Tuple[PieceType, int, int, int, bool, int]) -> None:
+        self.base, self.x, self.y, self.rotation, self.rotation_last, self.last_kick = state
+        self.name = self.base.name
+
     def draw(self, board_x: int, board_y: int, colour: Optional[ui.Colour] = None, shadow: bool = True) -> None:
         if shadow:
             old_y = self.y
-            while not self.on_floor():
-                self.y += 1
+            self.y += self.drop_distance()
             shadow_colour = colour
             if shadow_colour is None:
                 shadow_colour = ui.Colour.LIGHT_GREY
@@ -80,24 +113,17 @@ class Piece:
             self.y = old_y
         if colour is None:
             colour = self.base.colour
-        for y, row in enumerate(self.base.shapes[self.rotation]):
-            if 1 not in row:
-                continue
-            x = row.index(1)
-            count = sum(row[x:])
-            tx = self.x + x + board_x
-            ty = self.y + y + board_y
-            for dx in range(count):
-                self.game.ui.set_pixel(colour, tx+dx, ty)
+        x = self.x + board_x
+        y = self.y + board_y
+        for dx, dy in self.base.cells[self.rotation]:
+            self.game.ui.set_pixel(colour, x+dx, y+dy)
 
     def intersect(self) -> bool:
-        for y, row in enumerate(self.base.shapes[self.rotation]):
-            y += self.y
-            for x, c in enumerate(row):
-                x += self.x
-                if c and self.game.board_get(x, y):
-                    return True
-        return False
+        return self.game.board.collides(self.x, self.y, self.base.masks[self.rotation], self.base.bounds[self.rotation])
+
+    def drop_distance(self) -> int:
+        r = self.rotation
+        return self.game.board.drop_distance(self.x, self.y, self.base.bottoms[r], self.base.masks[r], self.base.bounds[r])
 
     def on_floor(self) -> bool:
         self.y += 1
@@ -116,12 +142,9 @@ class Piece:
         return True
 
     def lock(self) -> None:
-        for y, row in enumerate(self.base.shapes[self.rotation]):
-            y += self.y
-            for x, c in enumerate(row):
-                x += self.x
-                if c:
-                    self.game.board_set(x, y, self.base.colour)
+        shift = self.x + self.base.bounds[self.rotation][0]
+        for dy, mask in self.base.masks[self.rotation]:
+            self.game.board.place(self.y + dy, mask << shift, self.base.colour)
 
     def reset(self, hold: bool = False) -> None:
         self.rotation = 0
@@ -135,45 +158,72 @@ class Piece:
             self.y = -2
 
     def rotate(self, rotation_change: int) -> bool:
-        # O pieces don't rotate
-        if self.base is pieces[PIECE_O]:
+        rotation = self.game.rotation_system.kicks[self.base][self.rotation][rotation_change % 4]
+        if rotation is None:
             return True
-        # handle 180 rotations
-        old_rotation = self.rotation
-        self.rotation += rotation_change
-        self.rotation %= 4
-        if rotation_change % 4 == 2:
-            if not self.intersect():
-                self.rotation_last = True
-                self.last_kick = 0
-                return True
-            self.rotation = old_rotation
-            return False
-        # check kick table
-        old_x = self.x
-        old_y = self.y
-        clockwise = rotation_change % 4 == 1
-        kick_table = I_KICK_TABLE if self.base is pieces[PIECE_I] else MAIN_KICK_TABLE
-        index = old_rotation if clockwise else self.rotation
-        for i, kick in enumerate(kick_table[index]):
-            dx, dy = kick
-            if not clockwise:
-                dx = -dx
-                dy = -dy
-            self.x = old_x + dx
-            self.y = old_y + dy
-            if not self.intersect():
+        new_rotation, kicks = rotation
+        masks = self.base.masks[new_rotation]
+        bounds = self.base.bounds[new_rotation]
+        collides = self.game.board.collides
+        for i, (dx, dy) in enumerate(kicks):
+            if not collides(self.x + dx, self.y + dy, masks, bounds):
+                self.x += dx
+                self.y += dy
+                self.rotation = new_rotation
                 self.rotation_last = True
                 self.last_kick = i
                 return True
-        self.x = old_x
-        self.y = old_y
-        self.rotation = old_rotation
         return False
 
+class CachedRandom(random.Random):
+    # getstate is slow compared to the rest of a snapshot, so the state is
+    # kept until the generator is next used
+    state: Any
+    def seed(self, *args: Any, **kwargs: Any) -> None:
+        self.state = None
+        super().seed(*args, **kwargs)
+    def random(self) -> float:
+        self.state = None
+        return super().random()
+    def getrandbits(self, k: int) -> int:
+        self.state = None
+        return super().getrandbits(k)
+    def getstate(self) -> Any:
+        if self.state is None:
+            self.state = super().getstate()
+        return self.state
+    def setstate(self, state: Any) -> None:
+        if state is not self.state:
+            super().setstate(state)
+            self.state = state
+
 class Randomiser:
+    rng: random.Random
+    def __init__(self) -> None:
+        self.rng = CachedRandom()
+    def seed(self, seed: int) -> None:
+        self.rng.seed(seed)
+    def get_state(self) -> Any:
+        return self.rng.getstate()
+    def set_state(self, state: Any) -> None:
+        self.rng.setstate(state)
     def next_piece(self) -> int: raise NotImplementedError
 
+class Recorder:
+    def record_key(self, frame: int, key: Key, repeated: bool) -> None: raise NotImplementedError
+    def record_garbage(self, frame: int, lines: int) -> None: raise NotImplementedError
+    def record_exit(self, frame: int) -> None: raise NotImplementedError
+    def close(self, frame: int) -> None: raise NotImplementedError
+
+# score for each number of lines cleared, multiplied by the level
+SCORES = {
+    SpinType.NONE: (0, 100, 300, 500, 800),
+    SpinType.MINI: (100, 200, 400, 800),
+    SpinType.SPIN: (400, 800, 1200, 1600),
+}
+ALL_CLEAR_SCORES = (0, 800, 1200, 1800, 2000)
+B2B_ALL_CLEAR_SCORE = 3200
+
 class GameConfig:
     def __init__(self) -> None:
         self.width = 10
@@ -185,17 +235,47 @@ class GameConfig:
         self.objective_count = 0
         self.infinite_soft_drop = False
         self.hold_type = HoldType.NORMAL
+        self.rotation_system = "SRS"
+
+# attributes which are copied as they are by Game.snapshot
+COUNTERS = (
+    "paused", "fall_speed", "fall_ticks", "ground_ticks", "lock_count", "death_ticks",
+    "level", "lines", "score", "held", "no_hard_drop_ticks", "ticks", "b2b", "combo",
+    "countdown", "pieces_placed", "frames",
+)
+get_counters = operator.attrgetter(*COUNTERS)
+
+class GameState:
+    # everything that changes while a game is played, stored in immutable
+    # tuples and bytes so that snapshots can be shared and restored many times
+    __slots__ = ("board", "current_piece", "hold_piece", "next_pieces", "counters", "garbage_queue", "delayed_backfire_queue", "rng", "randomiser")
+    board: Tuple[Tuple[int, ...], bytes, int, Tuple[int, ...]]
+    current_piece: Tuple[PieceType, int, int, int, bool, int]
+    hold_piece: Optional[Tuple[PieceType, int, int, int, bool, int]]
+    next_pieces: Tuple[Tuple[PieceType, int, int, int, bool, int], ...]
+    counters: Tuple[Any, ...]
+    garbage_queue: Tuple[int, ...]
+    delayed_backfire_queue: Tuple[Tuple[int, int], ...]
+    rng: Any
+    randomiser: Any
 
 class Game(ui.Menu):
-    board: Dict[int, List[ui.Colour]]
+    board: bitboard.Board
     hold_piece: Optional[Piece]
     death_ticks: Optional[int]
     controls: Dict[Key, str]
     connection: Optional[multiplayer.Connection]
+    recorder: Optional[Recorder]
     garbage_queue: List[int]
     delayed_backfire_queue: List[Tuple[int, int]]
 
-    def __init__(self, config: GameConfig, randomiser: Randomiser, controls: Dict[Key, str]) -> None:
+    def __init__(self, config: GameConfig, randomiser: Randomiser, controls: Dict[Key, str], seed: Optional[int] = None) -> None:
+        # every random choice comes from the seed, so games can be replayed
+        if seed is None:
+            seed = random.getrandbits(63)
+        self.seed = seed
+        self.rng = CachedRandom(seed)
+        randomiser.seed(self.rng.getrandbits(63))
         self.paused = False
         self.config = config
         self.t_spin = SpinType.SPIN
@@ -203,7 +283,8 @@ class Game(ui.Menu):
         self.immobile_t = SpinType.NONE
         self.all_spin = SpinType.NONE
         self.controls = controls
-        self.board = {}
+        self.rotation_system = rotation_systems[config.rotation_system]
+        self.board = bitboard.Board(config.width, config.height)
         self.hold_piece = None
         self.fall_speed = 1.2
         self.fall_ticks = TPS / self.fall_speed
@@ -226,6 +307,10 @@ class Game(ui.Menu):
         self.delayed_backfire_queue = []
         self.countdown = 3 * TPS
         self.connection = None
+        self.recorder = None
+        self.headless = False
+        self.pieces_placed = 0
+        self.frames = 0
 
     def enable_custom_handling(self) -> bool:
         return True
@@ -234,25 +319,50 @@ class Game(ui.Menu):
         self.connection = connection
         self.enable_garbage_queue = True
 
+    def set_recorder(self, recorder: Recorder) -> None:
+        self.recorder = recorder
+
     def set_spins(self, t_spin: SpinType, mini_t_spin: SpinType, immobile_t: SpinType, all_spin: SpinType) -> None:
         self.t_spin = t_spin
         self.mini_t_spin = mini_t_spin
         self.immobile_t = immobile_t
         self.all_spin = all_spin
 
+    def snapshot(self) -> GameState:
+        state = GameState()
+        state.board = self.board.get_state()
+        state.current_piece = self.current_piece.get_state()
+        state.hold_piece = None if self.hold_piece is None else self.hold_piece.get_state()
+        state.next_pieces = tuple(piece.get_state() for piece in self.next_pieces)
+        state.counters = get_counters(self)
+        state.garbage_queue = tuple(self.garbage_queue)
+        state.delayed_backfire_queue = tuple(self.delayed_backfire_queue)
+        state.rng = self.rng.getstate()
+        state.randomiser = self.randomiser.get_state()
+        return state
+
+    def restore(self, state: GameState) -> None:
+        self.board.set_state(state.board)
+        self.current_piece = self.restore_piece(state.current_piece)
+        self.hold_piece = None if state.hold_piece is None else self.restore_piece(state.hold_piece)
+        self.next_pieces = [self.restore_piece(piece) for piece in state.next_pieces]
+        for name, value in zip(COUNTERS, state.counters):
+            setattr(self, name, value)
+        self.garbage_queue = list(state.garbage_queue)
+        self.delayed_backfire_queue = list(state.delayed_backfire_queue)
+        self.rng.setstate(state.rng)
+        self.randomiser.set_state(state.randomiser)
+
+    def restore_piece(self, state: Tuple[PieceType, int, int, int, bool, int]) -> Piece:
+        piece = Piece(state[0], self)
+        piece.set_state(state)
+        return piece
+
     def board_get(self, x: int, y: int) -> bool:
-        if y >= self.config.height:
-            return True
-        if not 0 <= x < self.config.width:
-            return True
-        if y not in self.board:
-            return False
-        return self.board[y][x] != ui.Colour.BLACK
+        return self.board.get(x, y)
 
     def board_set(self, x: int, y: int, colour: ui.Colour) -> None:
-        if y not in self.board:
-            self.board[y] = [ui.Colour.BLACK] * self.config.width
-        self.board[y][x] = colour
+        self.board.set(x, y, colour)
 
     def create_piece(self) -> Piece:
         return Piece(pieces[self.randomiser.next_piece()], self)
@@ -263,20 +373,20 @@ class Game(ui.Menu):
         piece.reset()
         return piece
 
-    def lock_piece(self) -> None:
-        # spin detection
+    def detect_spin(self, piece: Piece) -> SpinType:
+        # spin type for locking a piece where it is, which moves it to test for immobility
         spin_type = SpinType.NONE
-        if self.current_piece.rotation_last:
+        if piece.rotation_last:
             t_spin = False
             mini_t_spin = False
-            if self.current_piece.base is pieces[PIECE_T]:
+            if piece.base is pieces[PIECE_T]:
                 corners = 0
                 front_corners = 0
                 back_corners = 0
-                front_x, front_y = ((1, 0), (2, 1), (1, 2), (0, 1))[self.current_piece.rotation]
+                front_x, front_y = ((1, 0), (2, 1), (1, 2), (0, 1))[piece.rotation]
                 for dx, dy in ((0, 0), (0, 2), (2, 0), (2, 2)):
-                    x = self.current_piece.x + dx
-                    y = self.current_piece.y + dy
+                    x = piece.x + dx
+                    y = piece.y + dy
                     if 0 <= x < self.config.width and 0 <= y < self.config.height:
                         corner_filled = self.board_get(x, y)
                     else:
@@ -288,47 +398,38 @@ class Game(ui.Menu):
                 if front_corners == 2 and back_corners >= 1:
                     t_spin = True
                 elif front_corners == 1 and back_corners == 2:
-                    if self.current_piece.last_kick == 4:
+                    if piece.last_kick == 4:
                         t_spin = True
                     else:
                         mini_t_spin = True
             immobile = True
             for dx, dy in ((0, 1), (1, 0), (-1, 0), (0, -1)):
-                moved = self.current_piece.move(dx, dy)
+                moved = piece.move(dx, dy)
                 if moved:
                     immobile = False
-                    self.current_piece.move(-dx, -dy)
+                    piece.move(-dx, -dy)
                     break
             if t_spin:
                 spin_type = self.t_spin
             elif mini_t_spin:
                 spin_type = self.mini_t_spin
             elif immobile:
-                if self.current_piece.base is pieces[PIECE_T]:
+                if piece.base is pieces[PIECE_T]:
                     spin_type = self.immobile_t
                 else:
                     spin_type = self.all_spin
+        return spin_type
+
+    def lock_piece(self) -> None:
+        spin_type = self.detect_spin(self.current_piece)
 
         # clear lines
         self.current_piece.lock()
-        full = []
-        for y, line in self.board.items():
-            if all([c != ui.Colour.BLACK for c in line]):
-                full.append(y)
-        offset = 0
-        rows = sorted(self.board.keys())
-        rows.reverse()
-        for i in rows:
-            if i in full:
-                del self.board[i]
-                offset += 1
-            else:
-                if offset > 0:
-                    self.board[i+offset] = self.board[i]
-                    del self.board[i]
+        self.pieces_placed += 1
+        full = self.board.clear_lines()
 
         # check all clear, b2b, combo
-        all_clear = len(self.board) == 0
+        all_clear = self.board.is_empty()
         if spin_type != SpinType.NONE:
             if len(full) > 0:
                 self.b2b += 1
@@ -369,33 +470,29 @@ class Game(ui.Menu):
 
         # receive garbage
         if len(self.garbage_queue) > 0 and len(full) == 0:
+            masks = []
+            colours = bytearray()
             for lines in self.garbage_queue:
-                line = [ui.Colour.DARK_GREY] * self.config.width
-                line[random.randint(0, self.config.width-1)] = ui.Colour.BLACK
-                for _ in range(lines):
-                    for i in sorted(self.board.keys()):
-                        self.board[i-1] = self.board[i]
-                        self.board.pop(i)
-                    self.board[self.config.height-1] = line.copy()
-                    if self.current_piece.intersect():
-                        self.current_piece.y -= 1
+                hole = self.rng.randint(0, self.config.width-1)
+                line = bytearray([ui.Colour.DARK_GREY.value] * self.config.width)
+                line[hole] = ui.Colour.BLACK.value
+                masks += [self.board.full_row & ~(1 << hole)] * lines
+                colours += line * lines
+            piece = self.current_piece
+            piece.y -= self.board.rise_distance(piece.x, piece.y, piece.base.masks[piece.rotation], piece.base.bounds[piece.rotation], masks)
+            self.board.push_rows(masks, colours)
             self.redraw()
             self.garbage_queue = []
 
         # add score
-        if spin_type == SpinType.SPIN:
-            multiplier = (400, 800, 1200, 1600)[len(full)]
-        elif spin_type == SpinType.MINI:
-            multiplier = (100, 200, 400, 800)[len(full)]
-        else:
-            multiplier = (0, 100, 300, 500, 800)[len(full)]
+        multiplier = SCORES[spin_type][len(full)]
         if self.combo > 1:
             multiplier += (self.combo - 1) * 50
         if all_clear:
             if self.b2b > 1:
-                multiplier += 3200
+                multiplier += B2B_ALL_CLEAR_SCORE
             else:
-                multiplier += (0, 800, 1200, 1800, 2000)[len(full)]
+                multiplier += ALL_CLEAR_SCORES[len(full)]
         if self.b2b > 1 and len(full) > 0:
             multiplier = int(multiplier * 1.5)
         self.score += multiplier * self.level
@@ -429,7 +526,7 @@ class Game(ui.Menu):
         self.held = False
         self.no_hard_drop_ticks = int(MISCLICK_PROTECT_TIME * TPS)
         self.redraw()
-        if name:
+        if name and not self.headless:
             self.ui.draw_text(name, self.board_x+self.config.width//2, self.board_y-4, align=ui.Alignment.CENTER)
         if len(full) > 0:
             self.ui.beep()
@@ -444,7 +541,9 @@ class Game(ui.Menu):
             self.ground_ticks = self.config.lock_delay
 
     def init(self, main_ui: ui.UI) -> None:
-        self.ui = main_ui
+        # draw through a damage tracker so only changes are sent to the UI
+        self.ui = render.DamageTracker(main_ui)
+        self.headless = main_ui.headless
         self.resize(main_ui.width, main_ui.height)
 
     def resize(self, width: int, height: int) -> None:
@@ -459,14 +558,20 @@ class Game(ui.Menu):
         self.next_y = self.board_y + 1
         self.counter_x = self.hold_x - 5
         self.counter_y = self.board_y + 13
+        self.ui.reset()
+        self.draw_borders()
         self.redraw()
 
     def end_game(self) -> None:
         self.death_ticks = TPS * 3
         if self.connection is not None:
             self.connection.close()
+        if self.recorder is not None:
+            self.recorder.close(self.frames)
+            self.recorder = None
 
     def tick(self) -> None:
+        self.frames += 1
         if self.paused:
             return
         if self.death_ticks is not None:
@@ -480,13 +585,19 @@ class Game(ui.Menu):
                 self.redraw()
             return
         self.ticks += 1
-        self.redraw_timer()
+        if not self.headless:
+            self.redraw_timer()
         if self.connection is not None:
             messages = self.connection.recv()
             for command, data in messages:
                 if command == multiplayer.CMD_RECEIVE_GARBAGE:
-                    self.receive_garbage(int.from_bytes(data, "big"))
+                    lines = int.from_bytes(data, "big")
+                    if self.recorder is not None:
+                        self.recorder.record_garbage(self.frames, lines)
+                    self.receive_garbage(lines)
                 elif command == multiplayer.CMD_EXIT:
+                    if self.recorder is not None:
+                        self.recorder.record_exit(self.frames)
                     for i, text in enumerate(("Disconnected", "from server")):
                         self.ui.draw_text(text, self.board_x+self.config.width//2, self.board_y+7+i, align=ui.Alignment.CENTER)
                     self.ui.update_screen()
@@ -539,17 +650,54 @@ class Game(ui.Menu):
         self.fall_ticks -= 1
         if self.fall_ticks <= 0:
             self.fall_ticks = TPS / self.fall_speed
-            self.current_piece.draw(self.board_x, self.board_y, colour=ui.Colour.BLACK)
-            self.current_piece.move(0, 1)
-            self.current_piece.draw(self.board_x, self.board_y)
-        self.ui.update_screen()
+            if self.headless:
+                self.current_piece.move(0, 1)
+            else:
+                self.current_piece.draw(self.board_x, self.board_y, colour=ui.Colour.BLACK)
+                self.current_piece.move(0, 1)
+                self.current_piece.draw(self.board_x, self.board_y)
+        if not self.headless:
+            self.ui.update_screen()
 
     def key(self, c: str, repeated: bool = False) -> None:
+        for action in Key:
+            if c == self.controls[action]:
+                # rotate and clockwise turn the same way, so a key bound to both only turns once
+                if action == Key.CLOCKWISE and c == self.controls[Key.ROTATE]:
+                    continue
+                self.press(action, repeated)
+
+    def keys(self, presses: Sequence[Tuple[str, int]]) -> None:
+        # apply every key press before drawing once
+        self.ui.deferred = True
+        for c, repeats in presses:
+            if repeats == ui.INSTANT_REPEAT:
+                self.repeat_key(c)
+            elif repeats == 0:
+                self.key(c)
+            else:
+                for i in range(repeats):
+                    self.key(c, repeated=True)
+        self.ui.deferred = False
+        if not self.headless:
+            self.ui.update_screen()
+
+    def repeat_key(self, c: str) -> None:
+        # auto repeat with no delay, until the piece stops moving
+        for i in range(self.config.width + 2 * self.config.height):
+            state = self.current_piece.get_state()
+            self.key(c, repeated=True)
+            if self.current_piece.get_state() == state:
+                break
+
+    def press(self, action: Key, repeated: bool = False) -> None:
+        if self.recorder is not None:
+            self.recorder.record_key(self.frames, action, repeated)
         if self.death_ticks is not None:
-            if c == self.controls[Key.FORFEIT] and not repeated:
+            if action == Key.FORFEIT and not repeated:
                 self.ui.pop_menu()
             return
-        if c == self.controls[Key.FORFEIT]:
+        if action == Key.FORFEIT:
             self.paused = False
             self.redraw()
             self.ui.draw_text("Forfeited", self.board_x+self.config.width//2, self.board_y+7, align=ui.Alignment.CENTER)
@@ -557,26 +705,27 @@ class Game(ui.Menu):
             self.end_game()
             return
         if self.paused:
-            if c == self.controls[Key.PAUSE]:
+            if action == Key.PAUSE:
                 self.paused = False
                 self.redraw()
             return
-        if c == self.controls[Key.PAUSE]:
+        if action == Key.PAUSE:
             self.paused = True
             self.redraw()
             return
         if self.countdown:
             return
-        self.current_piece.draw(self.board_x, self.board_y, colour=ui.Colour.BLACK)
-        if c == self.controls[Key.SOFT_DROP]:
+        if not self.headless:
+            self.current_piece.draw(self.board_x, self.board_y, colour=ui.Colour.BLACK)
+        if action == Key.SOFT_DROP:
             count = self.config.height * 2 if self.config.infinite_soft_drop else 1
-            for i in range(count):
-                if self.current_piece.move(0, 1):
-                    self.score += 1
+            distance = min(count, self.current_piece.drop_distance())
+            if distance > 0:
+                self.current_piece.move(0, distance)
+                self.score += distance
             self.redraw_counters()
-        if c == self.controls[Key.HOLD] and not repeated:
+        elif action == Key.HOLD and not repeated:
             if not self.held and self.config.hold_type != HoldType.NONE:
-                self.current_piece.draw(self.board_x, self.board_y, colour=ui.Colour.BLACK)
                 self.redraw_hold_piece(colour=ui.Colour.BLACK)
                 if self.config.hold_type == HoldType.NORMAL:
                     self.held = True
@@ -596,28 +745,41 @@ class Game(ui.Menu):
                     self.redraw()
                 else:
                     self.redraw_hold_piece()
-        if c == self.controls[Key.LEFT]:
+        elif action == Key.LEFT:
             if self.current_piece.move(-1, 0):
                 self.lock_reset()
-        if c == self.controls[Key.RIGHT]:
+        elif action == Key.RIGHT:
             if self.current_piece.move(1, 0):
                 self.lock_reset()
-        if c == self.controls[Key.ANTICLOCKWISE] and not repeated:
+        elif action == Key.ANTICLOCKWISE and not repeated:
             if self.current_piece.rotate(-1):
                 self.lock_reset()
-        if (c == self.controls[Key.ROTATE] or c == self.controls[Key.CLOCKWISE]) and not repeated:
+        elif (action == Key.ROTATE or action == Key.CLOCKWISE) and not repeated:
             if self.current_piece.rotate(1):
                 self.lock_reset()
-        if c == self.controls[Key.ROTATE_180] and not repeated:
+        elif action == Key.ROTATE_180 and not repeated:
             if self.current_piece.rotate(2):
                 self.lock_reset()
-        if c == self.controls[Key.HARD_DROP] and not repeated:
+        elif action == Key.HARD_DROP and not repeated:
             if self.no_hard_drop_ticks <= 0:
-                while self.current_piece.move(0, 1):
-                    self.score += 2
+                distance = self.current_piece.drop_distance()
+                if distance > 0:
+                    self.current_piece.move(0, distance)
+                    self.score += 2 * distance
                 self.lock_piece()
-        self.current_piece.draw(self.board_x, self.board_y)
-        self.ui.update_screen()
+        if not self.headless:
+            self.current_piece.draw(self.board_x, self.board_y)
+            self.ui.update_screen()
+
+    def step(self, inputs: Sequence[Key] = (), ticks: int = 1) -> bool:
+        # apply inputs then advance the game, returning False once the game is over
+        for action in inputs:
+            self.press(action)
+        for i in range(ticks):
+            if self.death_ticks is not None:
+                break
+            self.tick()
+        return self.death_ticks is None
 
     def send_garbage(self, lines: int) -> None:
         if self.connection is not None:
@@ -625,28 +787,31 @@ class Game(ui.Menu):
         if self.config.garbage_type == GarbageType.BACKFIRE:
             self.receive_garbage(lines)
         elif self.config.garbage_type == GarbageType.DELAYED_BACKFIRE:
-            delay = random.random() * 10 + 5
+            delay = self.rng.random() * 10 + 5
             self.delayed_backfire_queue.append((lines, int(self.ticks + TPS * delay)))
 
     def receive_garbage(self, lines: int) -> None:
         if lines < 1:
             return
-        y = self.board_y + self.config.height - sum(self.garbage_queue) - 1
-        for i in range(lines-1):
-            self.ui.set_pixel(ui.Colour.BRIGHT_RED, self.board_x - 2, y)
-            y -= 1
-        self.ui.set_pixel(ui.Colour.RED, self.board_x - 2, y)
-        self.ui.update_screen()
+        if not self.headless:
+            y = self.board_y + self.config.height - sum(self.garbage_queue) - 1
+            for i in range(lines-1):
+                self.ui.set_pixel(ui.Colour.BRIGHT_RED, self.board_x - 2, y)
+                y -= 1
+            self.ui.set_pixel(ui.Colour.RED, self.board_x - 2, y)
+            self.ui.update_screen()
         self.garbage_queue.append(lines)
 
     def redraw_hold_piece(self, colour: Optional[ui.Colour] = None) -> None:
-        if self.hold_piece:
+        if self.hold_piece and not self.headless:
             if colour is None and self.held:
                 colour = ui.Colour.LIGHT_GREY
             self.hold_piece.draw(self.hold_x, self.hold_y, colour=colour, shadow=False)
 
-    def redraw(self, update: bool = True) -> None:
-        self.ui.clear()
+    def draw_borders(self) -> None:
+        # borders don't change, so they are only drawn again after resizing
+        if self.headless:
+            return
 
         # draw main border
         if self.enable_garbage_queue:
@@ -656,27 +821,32 @@ class Game(ui.Menu):
         for x in range(left, self.config.width+2):
             for y in range(self.config.height+1):
                 if x in (-2, 0, self.config.width+1) or y == self.config.height:
-                    self.ui.set_pixel(ui.Colour.WHITE, x+self.board_x-1, y+self.board_y)
+                    self.ui.set_static_pixel(ui.Colour.WHITE, x+self.board_x-1, y+self.board_y)
 
         # draw hold border
         if self.config.hold_type != HoldType.NONE:
             for x in range(5):
                 for y in range(6):
                     if x == 0 or y in (0, 5):
-                        self.ui.set_pixel(ui.Colour.WHITE, x+self.hold_x-1, y+self.hold_y-1)
+                        self.ui.set_static_pixel(ui.Colour.WHITE, x+self.hold_x-1, y+self.hold_y-1)
 
         # draw next piece border
         for x in range(6):
             for y in range(14):
                 if x in (0, 5) or y in (0, 13):
-                    self.ui.set_pixel(ui.Colour.WHITE, x+self.next_x-1, y+self.next_y-1)
+                    self.ui.set_static_pixel(ui.Colour.WHITE, x+self.next_x-1, y+self.next_y-1)
+
+    def redraw(self, update: bool = True) -> None:
+        if self.headless:
+            return
+        self.ui.clear()
 
         # draw board
-        for y, row in self.board.items():
+        for y, row in self.board.filled_rows():
             ty = y + self.board_y
             for x, c in enumerate(row):
                 tx = x + self.board_x
-                self.ui.set_pixel(c, tx, ty)
+                self.ui.set_pixel(bitboard.COLOURS[c], tx, ty)
 
         # draw garbage meter
         if self.enable_garbage_queue:
@@ -702,6 +872,9 @@ class Game(ui.Menu):
                 self.ui.set_pixel(ui.Colour.BLACK, x+self.hold_x, y+self.hold_y)
         self.redraw_hold_piece()
         self.redraw_counters()
+        if self.countdown == 0:
+            # drawn again here so clearing the screen doesn't erase and resend it
+            self.redraw_timer()
         if self.countdown > 0:
             self.ui.draw_text(str(self.countdown//TPS), self.board_x+self.config.width//2, self.board_y+7, align=ui.Alignment.CENTER)
         if self.paused:
@@ -710,6 +883,8 @@ class Game(ui.Menu):
             self.ui.update_screen()
 
     def redraw_counters(self) -> None:
+        if self.headless:
+            return
         self.ui.draw_text(f"Level: {self.level}", self.counter_x, self.counter_y)
         self.ui.draw_text(f"Lines: {self.lines}", self.counter_x, self.counter_y+1)
         self.ui.draw_text(f"Score: {self.score}", self.counter_x, self.counter_y+2)
@@ -723,26 +898,39 @@ class Game(ui.Menu):
 class ClassicRandomiser(Randomiser):
     previous: int
     def __init__(self) -> None:
+        super().__init__()
         self.previous = 0
+    def get_state(self) -> Any:
+        return (self.rng.getstate(), self.previous)
+    def set_state(self, state: Any) -> None:
+        rng_state, self.previous = state
+        self.rng.setstate(rng_state)
     def next_piece(self) -> int:
         i = self.previous
         while i == self.previous:
-            i = random.randint(0, 6)
+            i = self.rng.randint(0, 6)
         self.previous = i
         return i
 
 class BagRandomiser(Randomiser):
     bag: List[int]
     def __init__(self, n_7_pieces: int, n_extras: int) -> None:
+        super().__init__()
         self.n_7_pieces = n_7_pieces;
         self.n_extras = n_extras
         self.bag = []
+    def get_state(self) -> Any:
+        return (self.rng.getstate(), tuple(self.bag))
+    def set_state(self, state: Any) -> None:
+        rng_state, bag = state
+        self.rng.setstate(rng_state)
+        self.bag = list(bag)
     def next_piece(self) -> int:
         if not self.bag:
             self.bag = list(range(7)) * self.n_7_pieces
             for i in range(self.n_extras):
-                self.bag.append(random.randint(0, 6))
-            random.shuffle(self.bag)
+                self.bag.append(self.rng.randint(0, 6))
+            self.rng.shuffle(self.bag)
         return self.bag.pop()
 
 PIECE_L = 0
@@ -753,6 +941,9 @@ PIECE_S = 4
 PIECE_Z = 5
 PIECE_I = 6
 
+def get_piece_type(index: int) -> PieceType:
+    return pieces[index]
+
 pieces = [
     PieceType([[0, 0, 1], [1, 1, 1], [0, 0, 0]], ui.Colour.ORANGE, "L"),
     PieceType([[1, 0, 0], [1, 1, 1], [0, 0, 0]], ui.Colour.BLUE, "J"),
@@ -763,18 +954,4 @@ pieces = [
     PieceType([[0]*4, [1]*4, [0]*4, [0]*4], ui.Colour.CYAN, "I"),
 ]
 
-KICKS = ((0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2))
-
-MAIN_KICK_TABLE = (
-        KICKS,
-        tuple((-x, -y) for x, y in KICKS),
-        tuple((-x, y) for x, y in KICKS),
-        tuple((x, -y) for x, y in KICKS),
-)
-
-I_KICK_TABLE = (
-    ((0, 0), (-2, 0), (1, 0), (-2, 1), (1, -2)),
-    ((0, 0), (-1, 0), (2, 0), (-1, -2), (2, 1)),
-    ((0, 0), (2, 0), (-1, 0), (2, -1), (-1, 2)),
-    ((0, 0), (1, 0), (-2, 0), (1, 2), (-2, -1))
-)
+rotation_systems = {name: rotation.RotationSystem(name, definition, pieces) for name, definition in rotation.DEFINITIONS.items()}
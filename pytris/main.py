@@ -1,5 +1,5 @@
 import os, sys, time, importlib.util
-import game, ui, config, multiplayer, menu
+import game, ui, config, multiplayer, menu, replay, bot, rotation
 from typing import Sequence
 
 config.init()
@@ -8,6 +8,9 @@ use_terminal = False
 use_pygame = False
 server = False
 server_port = None
+run_benchmark = False
+run_bot = False
+bot_lobby = multiplayer.DEFAULT_LOBBY
 for arg in sys.argv[1:]:
     if arg == "--terminal":
         use_terminal = True
@@ -15,6 +18,12 @@ for arg in sys.argv[1:]:
         use_pygame = True
     elif arg == "--server":
         server = True
+    elif arg == "--benchmark":
+        run_benchmark = True
+    elif arg == "--bot":
+        run_bot = True
+    elif arg.startswith("--lobby="):
+        bot_lobby = arg[len("--lobby="):]
     elif arg.startswith("--port="):
         if server_port is not None:
             sys.exit("error: multiple ports specified")
@@ -25,12 +34,39 @@ for arg in sys.argv[1:]:
     else:
         sys.exit(f"error: invalid argument {arg}")
 
-if server_port is not None and not server:
+if server_port is not None and not server and not run_bot:
     sys.exit("error: --port used with client")
 
+if bot_lobby != multiplayer.DEFAULT_LOBBY and not run_bot:
+    sys.exit("error: --lobby used without --bot")
+
 if use_terminal and use_pygame:
     sys.exit("error: --terminal and --pygame cannot be used together")
 
+if run_benchmark:
+    import benchmark
+    benchmark.run()
+    sys.exit()
+
+if server:
+    multiplayer.server(server_port)
+    sys.exit()
+
+if run_bot:
+    # a bot which plays against a local server without a display
+    import null_ui
+    if server_port is None:
+        server_port = multiplayer.PYTRIS_PORT
+    connection = multiplayer.connect_to_server("127.0.0.1", str(server_port), bot_lobby)
+    if connection is None:
+        sys.exit("error: no server found")
+    x = game.Game(game.GameConfig(), game.BagRandomiser(1, 0), {key: key.name for key in game.Key})
+    x.set_spins(game.SpinType.SPIN, game.SpinType.MINI, game.SpinType.NONE, game.SpinType.NONE)
+    x.set_connection(connection)
+    null_ui.NullUI().push_menu(x)
+    bot.play(x, bot.Bot(), realtime=True)
+    sys.exit()
+
 if not use_terminal and not use_pygame:
     pygame_installed = importlib.util.find_spec("pygame") is not None
     in_terminal = sys.stdin is not None and sys.stdin.isatty()
@@ -41,10 +77,6 @@ if not use_terminal and not use_pygame:
     else:
         sys.exit("error: terminal and pygame are both unavailable (use --terminal or --pygame to force one to run)")
 
-if server:
-    multiplayer.server(server_port)
-    sys.exit()
-
 main_ui: ui.UI
 if use_pygame:
     import pygame_ui
@@ -118,9 +150,14 @@ class PlayButton(menu.Button):
             config.garbage_cancelling = garbage_cancelling_menu.current == 0
             config.hold_type = game.HoldType(hold_menu.current)
             config.lock_delay = lock_delay_selector.value
+            config.rotation_system = rotation.NAMES[rotation_menu.current]
             spin_types = [game.SpinType(m.current) for m in spin_menus]
         config.infinite_soft_drop = soft_drop_menu.current == 0
-        x = game.Game(config, randomiser, controls)
+        x: game.Game
+        if player_menu.current == 1:
+            x = bot.BotGame(config, randomiser, controls, bot.Bot(workers=min(4, os.cpu_count() or 1)))
+        else:
+            x = game.Game(config, randomiser, controls)
         x.set_spins(*spin_types)
         if self.multiplayer:
             server_ip = server_ip_input.value
@@ -129,14 +166,36 @@ class PlayButton(menu.Button):
             server_port = server_port_input.value
             if not server_port:
                 server_port = str(multiplayer.PYTRIS_PORT)
-            connection = multiplayer.connect_to_server(server_ip, server_port)
+            connection = multiplayer.connect_to_server(server_ip, server_port, lobby_input.value)
             if connection is None:
                 self.menu.set_info_text("No server found")
                 self.menu.resize(self.ui.width, self.ui.height)
                 return
             x.set_connection(connection)
+        replay.start_recording(x)
         self.ui.push_menu(x)
 
+class ReplayButton(menu.Button):
+    def __init__(self, name: str, path: str) -> None:
+        self.name = [name]
+        self.path = path
+    def click(self) -> None:
+        try:
+            recording = replay.load(self.path)
+        except (OSError, ValueError, EOFError):
+            self.menu.set_info_text("Invalid replay")
+            self.menu.resize(self.ui.width, self.ui.height)
+            return
+        self.ui.push_menu(replay.ReplayViewer(recording))
+
+class ReplaysButton(menu.Button):
+    def __init__(self, name: str) -> None:
+        self.name = [name]
+    def click(self) -> None:
+        folder = config.replay_folder()
+        names = sorted((name for name in os.listdir(folder) if name.endswith(".ptr")), reverse=True)[:20]
+        self.ui.push_menu(menu.Menu([menu.Selection("Close")] + [ReplayButton(name[:-4], f"{folder}/{name}") for name in names]))
+
 class SoftDropSelection(menu.Button):
     def __init__(self, name: str) -> None:
         self.name = [name]
@@ -285,11 +344,18 @@ garbage_menu = menu.Menu([
     menu.Selection("Delayed Backfire")
 ])
 
+rotation_menu = menu.Menu([menu.Selection(name) for name in rotation.NAMES])
+
 garbage_cancelling_menu = menu.Menu([
     menu.Selection("Enable"),
     menu.Selection("Disable")
 ])
 
+player_menu = menu.Menu([
+    menu.Selection("Human"),
+    menu.Selection("Bot")
+])
+
 spin_names = ("T Spin", "Mini T Spin", "Immobile T Piece", "Immobile Piece")
 spin_menus = [menu.Menu([menu.Selection("None"), menu.Selection("Mini Spin"), menu.Selection("Full Spin")], default) for default in (2, 1, 0, 0)]
 
@@ -301,12 +367,16 @@ lock_delay_selector = menu.NumberSelector("Lock Delay", 30, 0, 60, "{} frames")
 
 server_ip_input = menu.TextInput("Server IP", "Type in server IP address")
 server_port_input = menu.TextInput("Server Port", "Type in server IP address")
+lobby_input = menu.TextInput("Lobby", "Type in a lobby name to play against others in it")
 
 main_menu = menu.Menu([
     PlayButton("Play"),
     PlayButton("Multiplayer", multiplayer=True),
     server_ip_input,
     server_port_input,
+    lobby_input,
+    menu.PreviewSubmenu("Player", player_menu),
+    ReplaysButton("Replays"),
     menu.Submenu("Controls", controls_menu),
     menu.Submenu("Presets", preset_menu),
     menu.PreviewSubmenu("Objectives", objective_menu),
@@ -317,6 +387,7 @@ main_menu = menu.Menu([
     menu.PreviewSubmenu("Garbage", garbage_menu),
     menu.PreviewSubmenu("Garbage Cancelling", garbage_cancelling_menu),
     menu.Submenu("Spin Detection", spin_type_menu),
+    menu.PreviewSubmenu("Rotation System", rotation_menu),
     lock_delay_selector,
     menu.Submenu("UI Options", main_ui.get_options_menu()),
     menu.Selection("Quit")
@@ -0,0 +1,197 @@
+import game
+from typing import List, Optional, Tuple, Dict
+
+ROTATIONS = ((1, game.Key.CLOCKWISE), (-1, game.Key.ANTICLOCKWISE), (2, game.Key.ROTATE_180))
+
+# how a piece arrived at a position, which decides the spin type when it locks there
+ARRIVED_MOVING = 0
+ARRIVED_ROTATING = 1
+ARRIVED_KICK_4 = 2 # rotated using the last kick, which upgrades mini T spins
+
+# x margin around the board for pieces whose bounding box sticks out of it
+MARGIN = 4
+
+class Placement:
+    __slots__ = ("x", "y", "rotation", "spin", "keys")
+    x: int
+    y: int
+    rotation: int
+    spin: game.SpinType
+    keys: Tuple[game.Key, ...]
+
+    def __init__(self, x: int, y: int, rotation: int, spin: game.SpinType, keys: Tuple[game.Key, ...]) -> None:
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.spin = spin
+        self.keys = keys
+
+    def __repr__(self) -> str:
+        return f"Placement({self.x}, {self.y}, {self.rotation}, {self.spin}, {self.keys})"
+
+# for each piece type and rotation, the lowest rotation with the same cells and
+# the offset needed to match it, so symmetric positions are only reported once
+symmetry_cache: Dict[game.PieceType, List[Tuple[int, int, int]]] = {}
+
+def symmetry(piece_type: game.PieceType) -> List[Tuple[int, int, int]]:
+    if piece_type not in symmetry_cache:
+        result = []
+        for r, cells in enumerate(piece_type.cells):
+            left, top, right, bottom = piece_type.bounds[r]
+            shape = sorted((x - left, y - top) for x, y in cells)
+            for r2 in range(r + 1):
+                left2, top2, right2, bottom2 = piece_type.bounds[r2]
+                if sorted((x - left2, y - top2) for x, y in piece_type.cells[r2]) == shape:
+                    result.append((r2, left - left2, top - top2))
+                    break
+        symmetry_cache[piece_type] = result
+    return symmetry_cache[piece_type]
+
+def placements(x: game.Game, piece: Optional[game.Piece] = None) -> List[Placement]:
+    # breadth first search over every position the piece can reach using the
+    # game's own movement and rotation, returning each distinct lock position
+    # and spin type with the shortest key sequence that reaches it
+    if piece is None:
+        piece = x.current_piece
+    scratch = game.Piece(piece.base, x)
+    width = x.config.width + 2 * MARGIN
+    min_y = piece.y - x.config.height
+    rows = x.config.height + MARGIN - min_y
+    sym = symmetry(piece.base)
+    # states are numbered by arrival, rotation, row and column, with a byte for each
+    plane = 4 * rows * width
+    visited = bytearray(3 * plane)
+    # nodes are (x, y, rotation, arrival, parent index, keys), and the list doubles as the queue
+    nodes: List[Tuple[int, int, int, int, int, Tuple[game.Key, ...]]] = []
+    found: Dict[Tuple[int, int, int, game.SpinType], Placement] = {}
+
+    board = x.board
+    base = piece.base
+    masks = base.masks
+    bounds = base.bounds
+    bottoms = base.bottoms
+    # for each rotation, the (rotation, key, kicks) of each way of rotating,
+    # with kicks as (dx, dy, arrival if the piece ends up resting on something)
+    kicks = x.rotation_system.kicks[base]
+    turns: List[List[Tuple[int, game.Key, List[Tuple[int, int, int]]]]] = [[] for rotation in range(4)]
+    if kicks[0][1] is not None:
+        for rotation in range(4):
+            for change, key in ROTATIONS:
+                r, offsets = kicks[rotation][change % 4] # type: ignore
+                turns[rotation].append((r, key, [(dx, dy, ARRIVED_KICK_4 if kick == 4 else ARRIVED_ROTATING) for kick, (dx, dy) in enumerate(offsets)]))
+    infinite_soft_drop = x.config.infinite_soft_drop
+    board_rows = board.rows
+    hidden = board.hidden
+    board_width = board.width
+    board_height = board.height
+
+    # Collision maps have bit x + edge set where the piece would collide in a
+    # rotation and row, for rows from four above min_y, and -1 below the floor.
+    # They are built lazily from whole board rows with the walls as filled
+    # cells, so checking a position is a single bit test instead of a call to
+    # Board.collides.
+    edge = MARGIN + 2
+    walls = ((1 << edge) - 1) | (((1 << (edge + 8)) - 1) << (board_width + edge))
+    columns = [[(dy, [left + b for b in range(4) if mask >> b & 1]) for dy, mask in masks[r]] for r, (left, top, right, bottom) in enumerate(bounds)]
+    maps: List[List[Optional[int]]] = [[None] * (rows + 8) for r in range(4)]
+
+    def collision_map(rotation: int, py: int) -> int:
+        if py + bounds[rotation][3] >= board_height:
+            return -1
+        result = 0
+        for dy, shifts in columns[rotation]:
+            i = py + dy + hidden
+            row = (board_rows[i] << edge if i >= 0 else 0) | walls
+            for shift in shifts:
+                result |= row >> shift
+        return result
+
+    # Where a position leads doesn't depend on how the piece got there, so the
+    # moves from each position are only worked out once, as (state, x, y,
+    # rotation, arrival, keys), along with its drop distance
+    moves: List[Optional[List[Tuple[int, int, int, int, int, Tuple[game.Key, ...]]]]] = [None] * plane
+    distances = [0] * plane
+
+    def expand(px: int, py: int, rotation: int, position: int) -> List[Tuple[int, int, int, int, int, Tuple[game.Key, ...]]]:
+        result = []
+        distance = distances[position] = board.drop_distance(px, py, bottoms[rotation], masks[rotation], bounds[rotation])
+        if distance > 0:
+            result.append((position + distance * width, px, py + distance, rotation, ARRIVED_MOVING, (game.Key.SOFT_DROP,) * (1 if infinite_soft_drop else distance)))
+        # moves are checked as Piece.move would, skipping positions which
+        # have already been visited
+        row_maps = maps[rotation]
+        j = py - min_y + 4
+        m = row_maps[j]
+        if m is None:
+            m = row_maps[j] = collision_map(rotation, py)
+        for dx, key in ((-1, game.Key.LEFT), (1, game.Key.RIGHT)):
+            if not visited[position + dx] and not m >> (px + dx + edge) & 1:
+                result.append((position + dx, px + dx, py, rotation, ARRIVED_MOVING, (key,)))
+        # kicks are tried in order as Piece.rotate would, and the first which fits is used
+        for r, key, offsets in turns[rotation]:
+            row_maps = maps[r]
+            for dx, dy, rotated in offsets:
+                nx = px + dx
+                ny = py + dy
+                j = ny - min_y + 4
+                m = row_maps[j]
+                if m is None:
+                    m = row_maps[j] = collision_map(r, ny)
+                if m >> (nx + edge) & 1:
+                    continue
+                if ny >= min_y:
+                    i = (r * rows + ny - min_y) * width + nx + MARGIN
+                    # resting on something makes this a rotated arrival, but
+                    # there's no need to check when both have been visited
+                    if not visited[i] or not visited[i + rotated * plane]:
+                        m = row_maps[j + 1]
+                        if m is None:
+                            m = row_maps[j + 1] = collision_map(r, ny + 1)
+                        arrival = rotated if m >> (nx + edge) & 1 else ARRIVED_MOVING
+                        result.append((i + arrival * plane, nx, ny, r, arrival, (key,)))
+                break
+        return result
+
+    position = (piece.rotation * rows + piece.y - min_y) * width + piece.x + MARGIN
+    visited[position] = 1
+    nodes.append((piece.x, piece.y, piece.rotation, ARRIVED_MOVING, -1, ()))
+    index = 0
+    while index < len(nodes):
+        px, py, rotation, arrival, parent, keys = nodes[index]
+        position = (rotation * rows + py - min_y) * width + px + MARGIN
+        known = moves[position]
+        if known is None:
+            known = moves[position] = expand(px, py, rotation, position)
+        if distances[position] == 0:
+            # on the floor, so this is somewhere the piece can lock
+            spin = game.SpinType.NONE
+            if arrival != ARRIVED_MOVING:
+                scratch.x = px
+                scratch.y = py
+                scratch.rotation = rotation
+                scratch.rotation_last = True
+                scratch.last_kick = 4 if arrival == ARRIVED_KICK_4 else 0
+                spin = x.detect_spin(scratch)
+            r, dx, dy = sym[rotation]
+            lock = (px + dx, py + dy, r, spin)
+            if lock not in found:
+                found[lock] = Placement(px + dx, py + dy, r, spin, path(nodes, index))
+        for i, nx, ny, r, new_arrival, move_keys in known:
+            if not visited[i]:
+                visited[i] = 1
+                nodes.append((nx, ny, r, new_arrival, index, move_keys))
+        index += 1
+    return list(found.values())
+
+def path(nodes: List[Tuple[int, int, int, int, int, Tuple[game.Key, ...]]], index: int) -> Tuple[game.Key, ...]:
+    # keys from the starting position to a node, ending with a hard drop
+    # which makes any soft drop just before it unnecessary
+    parts = []
+    while index >= 0:
+        parts.append(nodes[index][5])
+        index = nodes[index][4]
+    keys = [key for part in reversed(parts) for key in part]
+    while keys and keys[-1] == game.Key.SOFT_DROP:
+        keys.pop()
+    keys.append(game.Key.HARD_DROP)
+    return tuple(keys)
@@ -1,70 +1,262 @@
-import select, socket, random, sys
-from typing import List, Tuple, Optional
+import asyncio, queue, socket, random, sys, threading
+from typing import Dict, List, Set, Tuple, Optional
 
 PYTRIS_PORT = 51737
 PROTOCOL_VERSION = 0
 CMD_SEND_GARBAGE = 1
 CMD_RECEIVE_GARBAGE = 2
+CMD_JOIN_LOBBY = 3 # data is the lobby name
+CMD_LEAVE_LOBBY = 4
 CMD_EXIT = -1
 
+# clients start in this lobby until they join another
+DEFAULT_LOBBY = ""
+
+# frames are a command byte and a two byte length, followed by that much data
+FRAME_HEADER = 3
+RECV_SIZE = 1 << 16
+
+class FrameBuffer:
+    # Incoming data is received straight into the space after what is already
+    # buffered, and every complete frame is parsed in one pass by moving an
+    # offset rather than slicing off the rest of the buffer. The unparsed end
+    # is only moved to the front when there isn't room for another read.
+    def __init__(self) -> None:
+        self.buf = bytearray(2 * RECV_SIZE)
+        self.start = 0
+        self.end = 0
+
+    def space(self, size: int = RECV_SIZE) -> memoryview:
+        # where at least size more bytes can be written, to be followed by received()
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buf) - self.end < size:
+            pending = self.end - self.start
+            if pending + size > len(self.buf):
+                buf = bytearray(pending + size)
+                buf[:pending] = memoryview(self.buf)[self.start:self.end]
+                self.buf = buf
+            else:
+                self.buf[:pending] = self.buf[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        return memoryview(self.buf)[self.end:]
+
+    def received(self, n: int) -> None:
+        self.end += n
+
+    def feed(self, data: bytes) -> None:
+        self.space(len(data))[:len(data)] = data
+        self.end += len(data)
+
+    def parse(self) -> List[Tuple[int, bytes]]:
+        buf = self.buf
+        start = self.start
+        end = self.end
+        frames = []
+        with memoryview(buf) as view:
+            while end - start >= FRAME_HEADER:
+                stop = start + FRAME_HEADER + (buf[start + 1] << 8 | buf[start + 2])
+                if stop > end:
+                    break
+                frames.append((buf[start], view[start + FRAME_HEADER:stop].tobytes()))
+                start = stop
+        self.start = start
+        return frames
+
 class Connection:
+    # The socket is only used by two background threads, so the game loop
+    # never waits on the network: a reader thread parses incoming frames onto
+    # a queue which recv() drains, and a writer thread sends whatever send()
+    # puts on the other queue.
     def __init__(self, socket: socket.socket) -> None:
         self.socket = socket
-        self.buf = b""
+        self.frames = FrameBuffer()
         self.version_sent = False
+        self.incoming: "queue.SimpleQueue[Tuple[int, bytes]]" = queue.SimpleQueue()
+        self.outgoing: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        threading.Thread(target=self.write_loop, daemon=True).start()
     def send(self, command: int, data: bytes) -> None:
-        self.socket.sendall(bytes([command, len(data) >> 8, len(data) & 0xFF]) + data)
+        self.outgoing.put(bytes([command, len(data) >> 8, len(data) & 0xFF]) + data)
     def recv(self) -> List[Tuple[int, bytes]]:
-        r, _, _ = select.select([self], [], [], 0)
-        if not r:
-            return []
-        data = self.socket.recv(1<<16)
-        if not data:
-            return [(CMD_EXIT, b"")]
-        self.buf += data
         commands = []
-        while len(self.buf) >= 3:
-            command = self.buf[0]
-            length = int.from_bytes(self.buf[1:3], "big")
-            if len(self.buf) < 3 + length:
-                break
-            commands.append((command, self.buf[3:3+length]))
-            self.buf = self.buf[3+length:]
+        while not self.incoming.empty():
+            commands.append(self.incoming.get())
         return commands
-    def fileno(self) -> int:
-        return self.socket.fileno()
+    def read_loop(self) -> None:
+        try:
+            while True:
+                n = self.socket.recv_into(self.frames.space())
+                if not n:
+                    break
+                self.frames.received(n)
+                for frame in self.frames.parse():
+                    self.incoming.put(frame)
+        except OSError:
+            pass
+        self.incoming.put((CMD_EXIT, b""))
+    def write_loop(self) -> None:
+        # sends everything queued since the last write together, until close()
+        while True:
+            data = self.outgoing.get()
+            chunks = []
+            while data is not None:
+                chunks.append(data)
+                if self.outgoing.empty():
+                    break
+                data = self.outgoing.get()
+            try:
+                if chunks:
+                    self.socket.sendall(b"".join(chunks))
+                if data is None:
+                    # wakes the reader thread, which is waiting in recv_into
+                    self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            if data is None:
+                self.socket.close()
+                return
     def close(self) -> None:
-        self.socket.close()
+        # the writer thread closes the socket once everything queued is sent
+        self.outgoing.put(None)
+
+# clients with more than this waiting to be sent can't keep up, and are disconnected
+SEND_HIGH_WATER = 1 << 16
+
+# seconds between status lines from the server, which are skipped if nothing changed
+STATUS_INTERVAL = 60
+
+class Client:
+    # a connection to the server, and the lobby it is playing in
+    lobby: Optional["Lobby"]
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.lobby = None
+    def queued(self) -> int:
+        return self.writer.transport.get_write_buffer_size()
+
+class Lobby:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.clients: List[Client] = []
+
+class Server:
+    # Each connection has its own task waiting for commands, so an idle
+    # server sleeps until something arrives. Garbage is only sent between
+    # clients in the same lobby, and lobbies are removed once they are empty.
+    lobbies: Dict[str, Lobby]
+
+    def __init__(self) -> None:
+        self.lobbies = {}
+        self.clients: Set[Client] = set()
+        self.stalls = 0 # sends which had to wait behind earlier data
+        self.dropped = 0
+
+    def queued(self) -> int:
+        return sum(client.queued() for client in self.clients)
+
+    def status(self) -> str:
+        return (f"{len(self.clients)} clients in {len(self.lobbies)} lobbies, {self.queued()} bytes queued, "
+            f"{self.stalls} stalled sends, {self.dropped} clients dropped")
+
+    def send(self, client: Client, command: int, data: bytes) -> None:
+        # Sends are queued by the transport and written whenever the socket
+        # can take them, so a slow client never holds up the others
+        writer = client.writer
+        if writer.is_closing():
+            return
+        if client.queued():
+            self.stalls += 1
+        writer.write(bytes([command, len(data) >> 8, len(data) & 0xFF]) + data)
+        if client.queued() > SEND_HIGH_WATER:
+            print(f"Disconnecting a client with {client.queued()} bytes queued", file=sys.stderr)
+            self.dropped += 1
+            writer.transport.abort()
+            print(self.status(), file=sys.stderr)
+
+    def join(self, client: Client, name: str) -> None:
+        self.leave(client)
+        lobby = self.lobbies.get(name)
+        if lobby is None:
+            lobby = self.lobbies[name] = Lobby(name)
+        lobby.clients.append(client)
+        client.lobby = lobby
+
+    def leave(self, client: Client) -> None:
+        lobby = client.lobby
+        if lobby is None:
+            return
+        lobby.clients.remove(client)
+        if not lobby.clients:
+            del self.lobbies[lobby.name]
+        client.lobby = None
+
+    def send_garbage(self, client: Client, data: bytes) -> None:
+        if client.lobby is None:
+            return
+        targets = [target for target in client.lobby.clients if target is not client]
+        if targets:
+            self.send(random.choice(targets), CMD_RECEIVE_GARBAGE, data)
+
+    def command(self, client: Client, command: int, data: bytes) -> bool:
+        if command == CMD_SEND_GARBAGE:
+            self.send_garbage(client, data)
+        elif command == CMD_JOIN_LOBBY:
+            self.join(client, data.decode("utf8", "replace"))
+        elif command == CMD_LEAVE_LOBBY:
+            self.leave(client)
+        else:
+            # only drop this client, rather than every game on the server
+            print(f"Unknown command {command}", file=sys.stderr)
+            return False
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = Client(writer)
+        self.clients.add(client)
+        self.join(client, DEFAULT_LOBBY)
+        frames = FrameBuffer()
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    break
+                frames.feed(data)
+                if not all(self.command(client, command, data) for command, data in frames.parse()):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.leave(client)
+            self.clients.discard(client)
+            writer.close()
+
+    async def log_status(self) -> None:
+        last = None
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL)
+            status = self.status()
+            if status != last:
+                print(status, file=sys.stderr)
+                last = status
+
+    async def serve(self, port: int) -> None:
+        s = await asyncio.start_server(self.handle, port=port, reuse_address=True)
+        status = asyncio.ensure_future(self.log_status())
+        try:
+            async with s:
+                await s.serve_forever()
+        finally:
+            status.cancel()
 
 def server(port: Optional[int]) -> None:
     if port is None:
         port = PYTRIS_PORT
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(("", port))
-        s.listen()
-        connections = []
-        while True:
-            r, _, _ = select.select([s], [], [], 0)
-            if r:
-                conn, address = s.accept()
-                connections.append(Connection(conn))
-            for connection in connections.copy():
-                for command, data in connection.recv():
-                    if command == CMD_SEND_GARBAGE:
-                        if len(connections) < 2:
-                            continue
-                        target = connection
-                        while target is connection:
-                            target = random.choice(connections)
-                        target.send(CMD_RECEIVE_GARBAGE, data)
-                    elif command == CMD_EXIT:
-                        connection.close()
-                        connections.remove(connection)
-                    else:
-                        sys.exit(f"Unknown command {command}")
-
-def connect_to_server(address: str, port: str) -> Optional[Connection]:
+    asyncio.run(Server().serve(port))
+
+def connect_to_server(address: str, port: str, lobby: str = DEFAULT_LOBBY) -> Optional[Connection]:
     if not port.isdigit():
         return None
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -72,4 +264,7 @@ def connect_to_server(address: str, port: str) -> Optional[Connection]:
         s.connect((address, int(port)))
     except Exception:
         return None
-    return Connection(s)
+    connection = Connection(s)
+    if lobby != DEFAULT_LOBBY:
+        connection.send(CMD_JOIN_LOBBY, lobby.encode("utf8"))
+    return connection
@@ -0,0 +1,57 @@
+import ui, menu
+from typing import List
+
+class NullUI(ui.UI):
+    headless = True
+    menus: List[ui.Menu]
+
+    def __init__(self, width: int = 40, height: int = 32) -> None:
+        self.menus = []
+        self.width = width
+        self.height = height
+        self.options_menu = menu.Menu([menu.Selection("Close")])
+
+    def init(self) -> None:
+        pass
+
+    def quit(self) -> None:
+        pass
+
+    def main_loop(self, tps: int = 60) -> None:
+        # nothing is displayed, so run ticks as fast as possible
+        prev_menu = None
+        while len(self.menus) > 0:
+            menu = self.menus[-1]
+            if menu is not prev_menu:
+                menu.resize(self.width, self.height)
+            menu.tick()
+            prev_menu = menu
+
+    def push_menu(self, menu: ui.Menu) -> None:
+        self.menus.append(menu)
+        menu.init(self)
+
+    def pop_menu(self) -> None:
+        if self.menus:
+            self.menus.pop()
+
+    def clear(self) -> None:
+        pass
+
+    def draw_text(self, text: str, x: int, y: int, fg_colour: ui.Colour = ui.Colour.WHITE, bg_colour: ui.Colour = ui.Colour.BLACK, align: ui.Alignment = ui.Alignment.LEFT) -> None:
+        pass
+
+    def set_pixel(self, colour: ui.Colour, x: int, y: int) -> None:
+        pass
+
+    def beep(self) -> None:
+        pass
+
+    def update_screen(self) -> None:
+        pass
+
+    def get_key(self) -> str:
+        return ""
+
+    def get_options_menu(self) -> menu.Menu:
+        return self.options_menu
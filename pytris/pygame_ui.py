@@ -1,10 +1,14 @@
-import sys, pygame
+import sys, time, collections, pygame
 import config, ui, menu
-from typing import Optional, Collection, Union, Dict, List
+from typing import Optional, Collection, Union, Dict, List, Tuple
 
 DEFAULT_DAS = 20
 DEFAULT_ARR = 3
 
+# most ticks to run before drawing a frame, after which the game falls
+# behind rather than spending ever longer catching up
+MAX_TICKS_PER_FRAME = 5
+
 pygame.init()
 KEY_TO_NAME = {
     pygame.K_UP: "Up",
@@ -21,6 +25,66 @@ def key_name(event: pygame.event.Event) -> str:
         return ui.ASCII_TO_NAME.get(event.unicode, event.unicode)
     return f"Key{event.scancode}"
 
+# fonts for each pixel size, since finding a system font scans them all
+fonts: Dict[int, pygame.font.Font] = {}
+
+def load_font(size: int) -> pygame.font.Font:
+    if size not in fonts:
+        fonts[size] = pygame.font.SysFont("courier", size)
+    return fonts[size]
+
+TextKey = Tuple[str, ui.Colour, ui.Colour, int]
+
+class TextCache:
+    # Rendered text with its background, keyed by text, colours and size, so
+    # counters and timers which are drawn again unchanged aren't rendered again.
+    # The least recently used text is dropped when over the budget in bytes.
+    images: "collections.OrderedDict[TextKey, pygame.Surface]"
+
+    def __init__(self, budget: int = 4 << 20) -> None:
+        self.budget = budget
+        self.size = 0
+        self.images = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str, fg_colour: ui.Colour, bg_colour: ui.Colour, size: int) -> pygame.Surface:
+        key = (text, fg_colour, bg_colour, size)
+        image = self.images.get(key)
+        if image is not None:
+            self.hits += 1
+            self.images.move_to_end(key)
+            return image
+        self.misses += 1
+        text_image = load_font(size).render(text, True, ui.COLOURS[fg_colour])
+        image = pygame.Surface(text_image.get_size()).convert()
+        image.fill(ui.COLOURS[bg_colour])
+        image.blit(text_image, (0, 0))
+        self.images[key] = image
+        self.size += image.get_width() * image.get_height() * image.get_bytesize()
+        while self.size > self.budget and len(self.images) > 1:
+            key, old = self.images.popitem(last=False)
+            self.size -= old.get_width() * old.get_height() * old.get_bytesize()
+        return image
+
+class FrameStats:
+    # timing of the main loop, for profiling
+    def __init__(self) -> None:
+        self.ticks = 0
+        self.frames = 0
+        self.overruns = 0 # frames which needed more than one tick to catch up
+        self.dropped_ticks = 0 # ticks skipped after running MAX_TICKS_PER_FRAME
+        self.frame_time = 0.0 # seconds between the last two frames
+        self.max_frame_time = 0.0
+        self.total_frame_time = 0.0
+
+    def mean_frame_time(self) -> float:
+        return self.total_frame_time / max(1, self.frames)
+
+    def summary(self) -> str:
+        return (f"{self.frames} frames, {self.ticks} ticks, {self.overruns} overruns, {self.dropped_ticks} dropped ticks, "
+            f"frame time {1000 * self.mean_frame_time():.1f} ms mean, {1000 * self.max_frame_time:.1f} ms max")
+
 class BeepSelection(menu.Button):
     def __init__(self, name: str, value: bool) -> None:
         self.name = [name]
@@ -38,9 +102,11 @@ class CloseButton(menu.Button):
 
 class PygameUI(ui.UI):
     screen: pygame.Surface
-    font: pygame.font.Font
     keys: Dict[str, int]
     menus: List[ui.Menu]
+    tiles: Dict[ui.Colour, pygame.Surface]
+    blits: List[Tuple[pygame.Surface, Tuple[int, int]]]
+    dirty: Optional[pygame.Rect]
 
     def __init__(self) -> None:
         self.menus = []
@@ -49,7 +115,13 @@ class PygameUI(ui.UI):
         self.target_height = self.height = 32
         self.pixel_size = 25
         self.screen = pygame.display.set_mode((self.width * self.pixel_size, self.height * self.pixel_size), pygame.RESIZABLE)
-        self.font = pygame.font.SysFont("courier", self.pixel_size)
+        self.text_cache = TextCache()
+        self.stats = FrameStats()
+        # pixels are drawn by copying a tile of their colour, all at once
+        # when the screen is updated, and only the area drawn to is updated
+        self.build_tiles()
+        self.blits = []
+        self.dirty = None
         self.beep_menu = menu.Menu([
             BeepSelection("Enable", True),
             BeepSelection("Disable", False)
@@ -79,11 +151,18 @@ class PygameUI(ui.UI):
 
     def quit(self) -> None:
         pygame.quit()
+        if self.stats.frames > 0:
+            print(self.stats.summary(), file=sys.stderr)
 
     def main_loop(self, tps: int = 60) -> None:
+        # game time is kept in step with real time by running as many ticks
+        # as have passed since the last frame, then drawing the frame once
         keys = {}
-        clock = pygame.time.Clock()
         prev_menu = None
+        stats = self.stats
+        tick_time = 1/tps
+        behind = 0.0
+        last_frame = time.perf_counter()
         while len(self.menus) > 0:
             menu = self.menus[-1]
             if menu is not prev_menu:
@@ -109,20 +188,47 @@ class PygameUI(ui.UI):
                     self.pixel_size = max(2, min(event.x // self.target_width, event.y // self.target_height))
                     self.width = event.x // self.pixel_size
                     self.height = event.y // self.pixel_size
-                    self.font = pygame.font.SysFont("courier", self.pixel_size)
+                    self.build_tiles()
                     menu.resize(self.width, self.height)
-            for key, frame in keys.items():
-                if frame == 0:
-                    menu.key(key)
-                if frame >= self.das:
-                    if self.arr == 0:
-                        for i in range(16):
-                            menu.key(key, repeated=True)
-                    elif (frame - self.das) % self.arr == 0:
-                        menu.key(key, repeated=True)
-                keys[key] += 1
-            menu.tick()
-            clock.tick(tps)
+            now = time.perf_counter()
+            behind += now - last_frame
+            stats.frame_time = now - last_frame
+            stats.max_frame_time = max(stats.max_frame_time, stats.frame_time)
+            stats.total_frame_time += stats.frame_time
+            last_frame = now
+            ticks = 0
+            while behind >= tick_time:
+                if not self.menus or self.menus[-1] is not menu:
+                    # the menu changed, so leave the rest of the ticks and any
+                    # held keys for it until it has been set up next frame
+                    break
+                if ticks == MAX_TICKS_PER_FRAME:
+                    stats.dropped_ticks += int(behind / tick_time)
+                    behind %= tick_time
+                    break
+                # keys pressed and repeated this tick are handled together
+                presses = []
+                for key, frame in keys.items():
+                    if frame == 0:
+                        presses.append((key, 0))
+                    if frame >= self.das:
+                        if self.arr == 0:
+                            presses.append((key, ui.INSTANT_REPEAT))
+                        elif (frame - self.das) % self.arr == 0:
+                            presses.append((key, 1))
+                    keys[key] += 1
+                if presses:
+                    menu.keys(presses)
+                menu.tick()
+                behind -= tick_time
+                ticks += 1
+            stats.ticks += ticks
+            if ticks > 1:
+                stats.overruns += 1
+            self.present()
+            stats.frames += 1
+            # wait for the next tick
+            time.sleep(max(0.0, tick_time - behind - (time.perf_counter() - last_frame)))
             prev_menu = menu
 
     def push_menu(self, menu: ui.Menu) -> None:
@@ -132,28 +238,58 @@ class PygameUI(ui.UI):
     def pop_menu(self) -> None:
         self.menus.pop()
 
+    def build_tiles(self) -> None:
+        self.tiles = {}
+        for colour, rgb in ui.COLOURS.items():
+            tile = pygame.Surface((self.pixel_size, self.pixel_size)).convert()
+            tile.fill(rgb)
+            self.tiles[colour] = tile
+
+    def add_dirty(self, rect: Tuple[int, int, int, int]) -> None:
+        if self.dirty is None:
+            self.dirty = pygame.Rect(rect)
+        else:
+            self.dirty.union_ip(rect)
+
+    def draw_blits(self) -> None:
+        if self.blits:
+            self.screen.blits(self.blits, doreturn=False)
+            self.blits = []
+
     def clear(self) -> None:
+        self.blits = []
         self.screen.fill(ui.COLOURS[ui.Colour.BLACK])
+        self.dirty = self.screen.get_rect()
 
     def draw_text(self, text: str, x: int, y: int, fg_colour: ui.Colour = ui.Colour.WHITE, bg_colour: ui.Colour = ui.Colour.BLACK, align: ui.Alignment = ui.Alignment.LEFT) -> None:
-        image = self.font.render(text, True, ui.COLOURS[fg_colour])
+        # pixels drawn before the text need to go underneath it
+        self.draw_blits()
+        image = self.text_cache.get(text, fg_colour, bg_colour, self.pixel_size)
         pixel_x = x * self.pixel_size
         pixel_y = y * self.pixel_size
         if align == ui.Alignment.CENTER:
             pixel_x -= image.get_width() // 2
         rect = (pixel_x, pixel_y, image.get_width(), image.get_height())
-        pygame.draw.rect(self.screen, ui.COLOURS[bg_colour], rect)
         self.screen.blit(image, (pixel_x, pixel_y))
+        self.add_dirty(rect)
 
     def set_pixel(self, colour: ui.Colour, x: int, y: int) -> None:
-        rect = (x*self.pixel_size, y*self.pixel_size, self.pixel_size, self.pixel_size)
-        pygame.draw.rect(self.screen, ui.COLOURS[colour], rect)
+        position = (x*self.pixel_size, y*self.pixel_size)
+        self.blits.append((self.tiles[colour], position))
+        self.add_dirty((position[0], position[1], self.pixel_size, self.pixel_size))
 
     def beep(self) -> None:
         pass
 
     def update_screen(self) -> None:
-        pygame.display.update()
+        # drawing is shown once per frame by main_loop
+        pass
+
+    def present(self) -> None:
+        self.draw_blits()
+        if self.dirty is not None:
+            pygame.display.update(self.dirty)
+            self.dirty = None
 
     def get_key_nonblocking(self) -> Optional[str]:
         while True:
@@ -0,0 +1,174 @@
+import ui
+from typing import Dict, Tuple, Set, List
+
+# text is keyed by where it is drawn, and stored with its colours
+TextKey = Tuple[int, int, ui.Alignment]
+Text = Tuple[str, ui.Colour, ui.Colour]
+
+# text in pygame is a little taller than a pixel, so it covers part of the row below
+TEXT_ROWS = 2
+
+def text_columns(text: str, x: int, align: ui.Alignment) -> Tuple[int, int]:
+    # columns of pixels which may be covered by text, allowing for characters
+    # being anywhere from half a pixel wide in terminals to a bit more in pygame
+    if align == ui.Alignment.CENTER:
+        return x - (len(text) + 1) // 2, x + (len(text) + 1) // 2 + 1
+    return x, x + len(text) + 1
+
+def overlaps(spans: Dict[int, List[Tuple[int, int]]], y: int, x0: int, x1: int) -> bool:
+    # whether anything in the rows covered by text overlaps columns x0 to x1
+    for row in range(y, y + TEXT_ROWS):
+        if any(a < x1 and x0 < b for a, b in spans.get(row, ())):
+            return True
+    return False
+
+class DamageTracker(ui.UI):
+    # Sits between a game and the real UI, keeping what should be on screen
+    # and what the UI last showed, so update_screen only sends cells which
+    # have changed. Drawing after clear() rebuilds the frame from scratch
+    # without sending anything which ends up the same. Static pixels such as
+    # borders are kept by clear() and only drawn again after reset().
+    pixels: Dict[Tuple[int, int], ui.Colour]
+    static: Dict[Tuple[int, int], ui.Colour]
+    shown: Dict[Tuple[int, int], ui.Colour]
+    texts: Dict[TextKey, Text]
+    shown_texts: Dict[TextKey, Text]
+    dirty: Set[Tuple[int, int]]
+    dirty_texts: Set[TextKey]
+
+    def __init__(self, backend: ui.UI) -> None:
+        self.backend = backend
+        self.headless = backend.headless
+        self.pixels = {}
+        self.static = {}
+        self.shown = {}
+        self.texts = {}
+        self.shown_texts = {}
+        self.dirty = set()
+        self.dirty_texts = set()
+        self.full_redraw = True
+        self.beeped = False
+        self.deferred = False # set to hold back updates until several changes are made
+
+    @property
+    def width(self) -> int: # type: ignore
+        return self.backend.width
+
+    @property
+    def height(self) -> int: # type: ignore
+        return self.backend.height
+
+    def reset(self) -> None:
+        # forget everything, including what is on screen, so the next update
+        # clears the UI and draws everything again, such as after resizing
+        self.pixels = {}
+        self.static = {}
+        self.shown = {}
+        self.texts = {}
+        self.shown_texts = {}
+        self.dirty = set()
+        self.dirty_texts = set()
+        self.full_redraw = True
+
+    def clear(self) -> None:
+        self.dirty.update(self.pixels)
+        self.dirty_texts.update(self.texts)
+        self.pixels = {}
+        self.texts = {}
+
+    def set_pixel(self, colour: ui.Colour, x: int, y: int) -> None:
+        self.pixels[x, y] = colour
+        self.dirty.add((x, y))
+
+    def set_static_pixel(self, colour: ui.Colour, x: int, y: int) -> None:
+        self.static[x, y] = colour
+        self.dirty.add((x, y))
+
+    def draw_text(self, text: str, x: int, y: int, fg_colour: ui.Colour = ui.Colour.WHITE, bg_colour: ui.Colour = ui.Colour.BLACK, align: ui.Alignment = ui.Alignment.LEFT) -> None:
+        key = (x, y, align)
+        self.texts[key] = (text, fg_colour, bg_colour)
+        self.dirty_texts.add(key)
+
+    def update_screen(self) -> None:
+        if self.headless or self.deferred:
+            return
+        backend = self.backend
+        if self.full_redraw:
+            backend.clear()
+            self.dirty.update(self.pixels)
+            self.dirty.update(self.static)
+            self.dirty_texts.update(self.texts)
+            self.full_redraw = False
+        elif not self.dirty and not self.dirty_texts and not self.beeped:
+            return
+
+        # text which has changed is erased by drawing the pixels under it again,
+        # since new text may not cover all of it. Terminals only write the
+        # cells which end up different.
+        damaged: Dict[int, List[Tuple[int, int]]] = {}
+        for text_key in self.dirty_texts:
+            old = self.shown_texts.get(text_key)
+            new = self.texts.get(text_key)
+            if old is None or old == new:
+                continue
+            x, y, align = text_key
+            x0, x1 = text_columns(old[0], x, align)
+            for row in range(y, y + TEXT_ROWS):
+                damaged.setdefault(row, []).append((x0, x1))
+                self.dirty.update((column, row) for column in range(x0, x1))
+
+        # send changed pixels, and any under text which was erased
+        black = ui.Colour.BLACK
+        shown = self.shown
+        drawn: Dict[int, List[Tuple[int, int]]] = {}
+        for pixel in self.dirty:
+            colour = self.pixels.get(pixel)
+            if colour is None:
+                colour = self.static.get(pixel, black)
+            x, y = pixel
+            if colour != shown.get(pixel, black) or (y in damaged and any(x0 <= x < x1 for x0, x1 in damaged[y])):
+                backend.set_pixel(colour, x, y)
+                drawn.setdefault(y, []).append((x, x + 1))
+            if colour == black:
+                shown.pop(pixel, None)
+            else:
+                shown[pixel] = colour
+
+        # text goes on top, so draw new text and anything which was drawn over
+        for text_key, (text, fg_colour, bg_colour) in self.texts.items():
+            x, y, align = text_key
+            x0, x1 = text_columns(text, x, align)
+            if (text_key in self.dirty_texts and self.shown_texts.get(text_key) != (text, fg_colour, bg_colour)) or overlaps(drawn, y, x0, x1):
+                backend.draw_text(text, x, y, fg_colour, bg_colour, align)
+                for row in range(y, y + TEXT_ROWS):
+                    drawn.setdefault(row, []).append((x0, x1))
+        self.shown_texts = dict(self.texts)
+        self.dirty = set()
+        self.dirty_texts = set()
+        self.beeped = False
+        backend.update_screen()
+
+    def beep(self) -> None:
+        self.backend.beep()
+        self.beeped = True
+
+    def init(self) -> None:
+        self.backend.init()
+
+    def quit(self) -> None:
+        self.backend.quit()
+
+    def main_loop(self, tps: int = 60) -> None:
+        self.backend.main_loop(tps)
+
+    def push_menu(self, menu: ui.Menu) -> None:
+        self.backend.push_menu(menu)
+
+    def pop_menu(self) -> None:
+        self.backend.pop_menu()
+
+    def get_key(self) -> str:
+        return self.backend.get_key()
+
+    def get_options_menu(self) -> ui.Menu:
+        return self.backend.get_options_menu()
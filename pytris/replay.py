@@ -0,0 +1,277 @@
+import time, bisect
+import game, config, multiplayer, null_ui, ui, rotation
+from typing import BinaryIO, List, Tuple, Dict
+
+# A replay file starts with MAGIC, a version byte and a header of varints
+# describing the game. It is followed by events, each made of a varint
+# frame delta and one action byte. Key presses use the key value, with
+# REPEATED set for auto-repeated keys. Garbage events are followed by a
+# varint line count.
+MAGIC = b"PTRP"
+VERSION = 0
+REPEATED = 0x80
+EVENT_GARBAGE = 0x7F
+EVENT_EXIT = 0x7E
+EVENT_END = 0x7D
+
+RANDOMISER_BAG = 0
+RANDOMISER_CLASSIC = 1
+
+KEYFRAME_INTERVAL = 10 * game.TPS
+SEEK_TIME = 5 * game.TPS
+
+def encode_varint(n: int) -> bytes:
+    data = bytearray()
+    while n >= 0x80:
+        data.append((n & 0x7F) | 0x80)
+        n >>= 7
+    data.append(n)
+    return bytes(data)
+
+def read_varint(stream: BinaryIO) -> int:
+    n = 0
+    shift = 0
+    while True:
+        c = stream.read(1)
+        if not c:
+            raise EOFError("unexpected end of replay")
+        n |= (c[0] & 0x7F) << shift
+        shift += 7
+        if c[0] < 0x80:
+            return n
+
+def header(x: game.Game) -> List[int]:
+    c = x.config
+    values = [
+        x.seed,
+        x.connection is not None,
+        c.width,
+        c.height,
+        c.lock_delay,
+        c.garbage_type.value,
+        c.garbage_cancelling,
+        c.objective_type.value,
+        c.objective_count,
+        c.infinite_soft_drop,
+        c.hold_type.value,
+        rotation.NAMES.index(c.rotation_system),
+        x.t_spin.value,
+        x.mini_t_spin.value,
+        x.immobile_t.value,
+        x.all_spin.value,
+    ]
+    if isinstance(x.randomiser, game.BagRandomiser):
+        values += [RANDOMISER_BAG, x.randomiser.n_7_pieces, x.randomiser.n_extras]
+    elif isinstance(x.randomiser, game.ClassicRandomiser):
+        values += [RANDOMISER_CLASSIC]
+    else:
+        raise ValueError("randomiser cannot be saved in a replay")
+    return [int(value) for value in values]
+
+class ReplayRecorder(game.Recorder):
+    def __init__(self, stream: BinaryIO, x: game.Game) -> None:
+        self.stream = stream
+        self.frame = 0
+        self.stream.write(MAGIC + bytes([VERSION]) + b"".join(encode_varint(value) for value in header(x)))
+
+    def write_event(self, frame: int, action: int, data: bytes = b"") -> None:
+        self.stream.write(encode_varint(frame - self.frame) + bytes([action]) + data)
+        self.frame = frame
+
+    def record_key(self, frame: int, key: game.Key, repeated: bool) -> None:
+        self.write_event(frame, key.value | (REPEATED if repeated else 0))
+
+    def record_garbage(self, frame: int, lines: int) -> None:
+        self.write_event(frame, EVENT_GARBAGE, encode_varint(lines))
+
+    def record_exit(self, frame: int) -> None:
+        self.write_event(frame, EVENT_EXIT)
+
+    def close(self, frame: int) -> None:
+        self.write_event(frame, EVENT_END)
+        self.stream.close()
+
+class Replay:
+    # events are (frame, action, value) where value is the number of garbage
+    # lines for garbage events and otherwise unused
+    events: List[Tuple[int, int, int]]
+
+    def __init__(self, stream: BinaryIO) -> None:
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a replay file")
+        version = stream.read(1)
+        if not version or version[0] != VERSION:
+            raise ValueError("unsupported replay version")
+        self.seed = read_varint(stream)
+        self.multiplayer = read_varint(stream) != 0
+        self.config = game.GameConfig()
+        self.config.width = read_varint(stream)
+        self.config.height = read_varint(stream)
+        self.config.lock_delay = read_varint(stream)
+        self.config.garbage_type = game.GarbageType(read_varint(stream))
+        self.config.garbage_cancelling = read_varint(stream) != 0
+        self.config.objective_type = game.Objective(read_varint(stream))
+        self.config.objective_count = read_varint(stream)
+        self.config.infinite_soft_drop = read_varint(stream) != 0
+        self.config.hold_type = game.HoldType(read_varint(stream))
+        self.config.rotation_system = rotation.NAMES[read_varint(stream)]
+        self.spins = [game.SpinType(read_varint(stream)) for i in range(4)]
+        self.randomiser_type = read_varint(stream)
+        if self.randomiser_type == RANDOMISER_BAG:
+            self.bag_size = (read_varint(stream), read_varint(stream))
+        elif self.randomiser_type != RANDOMISER_CLASSIC:
+            raise ValueError("unknown randomiser in replay")
+        self.events = []
+        self.complete = False
+        frame = 0
+        while True:
+            # a replay from a game which was never finished has no end event
+            try:
+                frame += read_varint(stream)
+                action = stream.read(1)
+                if not action:
+                    break
+                value = 0
+                if action[0] == EVENT_GARBAGE:
+                    value = read_varint(stream)
+            except EOFError:
+                break
+            if action[0] == EVENT_END:
+                self.complete = True
+                self.length = frame
+                break
+            self.events.append((frame, action[0], value))
+        if not self.complete:
+            self.length = frame
+
+    def create_game(self) -> game.Game:
+        randomiser: game.Randomiser
+        if self.randomiser_type == RANDOMISER_BAG:
+            randomiser = game.BagRandomiser(*self.bag_size)
+        else:
+            randomiser = game.ClassicRandomiser()
+        x = game.Game(self.config, randomiser, {key: key.name for key in game.Key}, seed=self.seed)
+        x.set_spins(*self.spins)
+        return x
+
+class ReplayConnection(multiplayer.Connection):
+    # feeds recorded server messages to a game being played back
+    messages: List[Tuple[int, bytes]]
+    def __init__(self) -> None:
+        self.messages = []
+    def send(self, command: int, data: bytes) -> None:
+        pass
+    def recv(self) -> List[Tuple[int, bytes]]:
+        messages = self.messages
+        self.messages = []
+        return messages
+    def close(self) -> None:
+        pass
+
+class ReplayPlayer:
+    # keyframes map a frame to a snapshot of the game and the index of the next event
+    keyframes: Dict[int, Tuple[game.GameState, int]]
+    keyframe_frames: List[int]
+
+    def __init__(self, replay: Replay, keyframe_interval: int = KEYFRAME_INTERVAL) -> None:
+        self.replay = replay
+        self.keyframe_interval = keyframe_interval
+        self.game = replay.create_game()
+        self.connection = ReplayConnection()
+        if replay.multiplayer:
+            self.game.set_connection(self.connection)
+        self.game.init(null_ui.NullUI())
+        self.event_index = 0
+        self.keyframes = {}
+        self.keyframe_frames = []
+        self.add_keyframe()
+
+    def add_keyframe(self) -> None:
+        frame = self.game.frames
+        if frame not in self.keyframes:
+            self.keyframes[frame] = (self.game.snapshot(), self.event_index)
+            bisect.insort(self.keyframe_frames, frame)
+
+    def finished(self) -> bool:
+        return self.game.frames >= self.replay.length and self.event_index == len(self.replay.events)
+
+    def step(self) -> None:
+        events = self.replay.events
+        frame = self.game.frames
+        # keys pressed after the last tick
+        while self.event_index < len(events) and events[self.event_index][0] == frame:
+            _, action, _ = events[self.event_index]
+            if action != EVENT_GARBAGE and action != EVENT_EXIT:
+                self.game.press(game.Key(action & ~REPEATED), action & REPEATED != 0)
+            self.event_index += 1
+        if frame >= self.replay.length:
+            # the key which ended the game is recorded on the last frame, with no tick after it
+            self.event_index = len(events)
+            return
+        # server messages received during the next tick
+        while self.event_index < len(events) and events[self.event_index][0] == frame + 1:
+            _, action, value = events[self.event_index]
+            if action == EVENT_GARBAGE:
+                self.connection.messages.append((multiplayer.CMD_RECEIVE_GARBAGE, value.to_bytes(1, "big")))
+            elif action == EVENT_EXIT:
+                self.connection.messages.append((multiplayer.CMD_EXIT, b""))
+            else:
+                break
+            self.event_index += 1
+        self.game.tick()
+        if self.game.frames % self.keyframe_interval == 0:
+            self.add_keyframe()
+
+    def seek(self, frame: int) -> None:
+        frame = max(0, min(frame, self.replay.length))
+        i = bisect.bisect_right(self.keyframe_frames, frame) - 1
+        keyframe = self.keyframe_frames[i]
+        if frame < self.game.frames or keyframe > self.game.frames:
+            snapshot, self.event_index = self.keyframes[keyframe]
+            self.game.restore(snapshot)
+            self.connection.messages = []
+        # simulate the rest without drawing
+        headless = self.game.headless
+        self.game.headless = True
+        while self.game.frames < frame or (frame == self.replay.length and not self.finished()):
+            self.step()
+        self.game.headless = headless
+
+class ReplayViewer(ui.Menu):
+    def __init__(self, replay: Replay) -> None:
+        self.player = ReplayPlayer(replay)
+        self.paused = False
+
+    def enable_custom_handling(self) -> bool:
+        return False
+
+    def init(self, main_ui: ui.UI) -> None:
+        self.ui = main_ui
+        self.player.game.init(main_ui)
+
+    def resize(self, width: int, height: int) -> None:
+        self.player.game.resize(width, height)
+
+    def tick(self) -> None:
+        if not self.paused and not self.player.finished():
+            self.player.step()
+
+    def key(self, c: str, repeated: bool = False) -> None:
+        if c == "Escape" and not repeated:
+            self.ui.pop_menu()
+        elif c == "Space" and not repeated:
+            self.paused = not self.paused
+        elif c == "Left":
+            self.player.seek(self.player.game.frames - SEEK_TIME)
+            self.player.game.redraw()
+        elif c == "Right":
+            self.player.seek(self.player.game.frames + SEEK_TIME)
+            self.player.game.redraw()
+
+def load(path: str) -> Replay:
+    with open(path, "rb") as f:
+        return Replay(f)
+
+def start_recording(x: game.Game) -> None:
+    name = time.strftime("%Y-%m-%d_%H-%M-%S")
+    x.set_recorder(ReplayRecorder(open(f"{config.replay_folder()}/{name}.ptr", "wb"), x))
@@ -0,0 +1,128 @@
+from typing import Dict, Optional, Sequence, Tuple, List, Any
+
+# Rotation systems are defined by their kick tables, written as in most
+# published tables with y pointing up. Each table maps a (from, to) rotation
+# pair to the offsets to try in order, and pairs which are left out only try
+# rotating in place. Rotation 0 is the spawn rotation and 1 is clockwise from
+# it. Tables are given for groups of pieces by name, and a group with None
+# for its table doesn't rotate at all. Offsets move each rotation of a piece
+# relative to where it is in SRS, for systems which rotate pieces around a
+# different point.
+Kicks = Tuple[Tuple[int, int], ...]
+KickTable = Dict[Tuple[int, int], Kicks]
+
+SRS_KICKS: KickTable = {
+    (0, 1): ((0, 0), (-1, 0), (-1, 1), (0, -2), (-1, -2)),
+    (1, 0): ((0, 0), (1, 0), (1, -1), (0, 2), (1, 2)),
+    (1, 2): ((0, 0), (1, 0), (1, -1), (0, 2), (1, 2)),
+    (2, 1): ((0, 0), (-1, 0), (-1, 1), (0, -2), (-1, -2)),
+    (2, 3): ((0, 0), (1, 0), (1, 1), (0, -2), (1, -2)),
+    (3, 2): ((0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2)),
+    (3, 0): ((0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2)),
+    (0, 3): ((0, 0), (1, 0), (1, 1), (0, -2), (1, -2)),
+}
+
+SRS_I_KICKS: KickTable = {
+    (0, 1): ((0, 0), (-2, 0), (1, 0), (-2, -1), (1, 2)),
+    (1, 0): ((0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)),
+    (1, 2): ((0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)),
+    (2, 1): ((0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)),
+    (2, 3): ((0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)),
+    (3, 2): ((0, 0), (-2, 0), (1, 0), (-2, -1), (1, 2)),
+    (3, 0): ((0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)),
+    (0, 3): ((0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)),
+}
+
+# the I kicks used by SRS+, which are the same either way round
+SRS_PLUS_I_KICKS: KickTable = {
+    (0, 1): ((0, 0), (1, 0), (-2, 0), (-2, -1), (1, 2)),
+    (1, 0): ((0, 0), (-1, 0), (2, 0), (-1, -2), (2, 1)),
+    (1, 2): ((0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)),
+    (2, 1): ((0, 0), (-2, 0), (1, 0), (-2, 1), (1, -2)),
+    (2, 3): ((0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)),
+    (3, 2): ((0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)),
+    (3, 0): ((0, 0), (1, 0), (-2, 0), (1, 2), (-2, -1)),
+    (0, 3): ((0, 0), (-1, 0), (2, 0), (2, -1), (-1, 2)),
+}
+
+HALF_KICKS: KickTable = {
+    (0, 2): ((0, 0), (0, 1), (1, 1), (-1, 1), (1, 0), (-1, 0)),
+    (2, 0): ((0, 0), (0, -1), (-1, -1), (1, -1), (-1, 0), (1, 0)),
+    (1, 3): ((0, 0), (1, 0), (1, 2), (1, 1), (0, 2), (0, 1)),
+    (3, 1): ((0, 0), (-1, 0), (-1, 2), (-1, 1), (0, 2), (0, 1)),
+}
+
+# kicks one column right then left, without ever kicking up
+SIDE_KICKS: KickTable = {
+    (a, b): ((0, 0), (1, 0), (-1, 0)) for a in range(4) for b in range(4) if a != b
+}
+
+# Arika's rotation system rests horizontal pieces on the bottom of their box
+# and only has two rotations for I, S and Z
+ARS_OFFSETS = {
+    "LJT": ((0, -1), (0, 0), (0, 0), (0, 0)),
+    "SZ": ((0, -1), (-1, 0), (0, 0), (0, 0)),
+    "I": ((0, 0), (0, 0), (0, 1), (1, 0)),
+}
+
+# Nintendo's rotation system turns pieces around their centre, with two
+# rotations for I, S and Z
+NRS_OFFSETS = {
+    "SZ": ((0, 0), (0, 0), (0, 1), (1, 0)),
+    "I": ((0, 0), (0, 0), (0, 1), (1, 0)),
+}
+
+DEFINITIONS: Dict[str, Dict[str, Any]] = {
+    "SRS": {
+        "kicks": {"LJTSZ": SRS_KICKS, "I": SRS_I_KICKS, "O": None},
+    },
+    "SRS+": {
+        "kicks": {"LJTSZ": {**SRS_KICKS, **HALF_KICKS}, "I": {**SRS_PLUS_I_KICKS, **HALF_KICKS}, "O": None},
+    },
+    "ARS": {
+        "kicks": {"LJTSZ": SIDE_KICKS, "I": {}, "O": None},
+        "offsets": ARS_OFFSETS,
+    },
+    "NRS": {
+        "kicks": {"LJTSZ": {}, "I": {}, "O": None},
+        "offsets": NRS_OFFSETS,
+    },
+}
+
+NAMES = list(DEFINITIONS)
+
+# for each rotation and change in rotation (mod 4), None if the piece doesn't
+# rotate, or the new rotation and the (dx, dy) moves to try in order
+CompiledKicks = List[List[Optional[Tuple[int, Kicks]]]]
+
+def find_group(groups: Dict[str, Any], name: str) -> Any:
+    for group, value in groups.items():
+        if name in group:
+            return value
+    return None
+
+class RotationSystem:
+    kicks: Dict[Any, CompiledKicks]
+
+    def __init__(self, name: str, definition: Dict[str, Any], pieces: Sequence[Any]) -> None:
+        # compile the definition for each piece type, converting to y pointing down
+        self.name = name
+        self.kicks = {}
+        offset_groups = definition.get("offsets", {})
+        for piece in pieces:
+            table = find_group(definition["kicks"], piece.name)
+            offsets = find_group(offset_groups, piece.name)
+            if offsets is None:
+                offsets = ((0, 0),) * 4
+            compiled: CompiledKicks = []
+            for rotation in range(4):
+                changes: List[Optional[Tuple[int, Kicks]]] = [None] * 4
+                if table is not None:
+                    for change in (1, 2, 3):
+                        new_rotation = (rotation + change) % 4
+                        dx = offsets[new_rotation][0] - offsets[rotation][0]
+                        dy = offsets[new_rotation][1] - offsets[rotation][1]
+                        kicks = table.get((rotation, new_rotation), ((0, 0),))
+                        changes[change] = (new_rotation, tuple((dx + kx, -(dy + ky)) for kx, ky in kicks))
+                compiled.append(changes)
+            self.kicks[piece] = compiled
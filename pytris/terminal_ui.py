@@ -1,6 +1,6 @@
-import sys, time, os, shutil, select
+import sys, time, os, shutil, select, codecs, collections, atexit
 import config, ui, menu
-from typing import Optional, Collection, Union, List
+from typing import Optional, Collection, Union, List, Set, Tuple, Deque, Any
 
 SCANCODE_TO_NAME = {
     0x48: "Up",
@@ -46,6 +46,101 @@ COLOURS_8_BIT = {
     ui.Colour.MAGENTA: 129,
 }
 
+# a character cell on screen, with its foreground and background colours
+Cell = Tuple[str, ui.Colour, ui.Colour]
+BLANK: Cell = (" ", ui.Colour.WHITE, ui.Colour.BLACK)
+
+# unchanged cells between two changes which are written again rather than
+# moving the cursor past them, since a cursor move is several bytes
+MAX_GAP = 3
+
+# how long to wait for the rest of an escape code before treating the escape
+# as the Escape key
+ESCAPE_TIMEOUT = 0.05
+
+def escape_code_end(text: str, i: int) -> Optional[int]:
+    # index after the escape code starting at i, or None if it isn't complete
+    if i + 1 >= len(text):
+        return None
+    c = text[i+1]
+    if c == "\x1b":
+        return i + 1
+    if c == "[":
+        # control sequence, ending with a character from @ to ~
+        for j in range(i + 2, len(text)):
+            if "@" <= text[j] <= "~":
+                return j + 1
+        return None
+    if c == "O":
+        # used for arrow keys by some terminals
+        return i + 3 if i + 2 < len(text) else None
+    return i + 2
+
+class KeyDecoder:
+    # Turns bytes read from a terminal into key names in the order they were
+    # pressed, keeping incomplete characters and escape codes until the rest
+    # arrives, or until the escape on its own has waited long enough to be
+    # the Escape key
+    deadline: Optional[float]
+
+    def __init__(self) -> None:
+        self.utf8 = codecs.getincrementaldecoder("utf8")(errors="replace")
+        self.text = ""
+        self.deadline = None
+
+    def decode(self, data: bytes, now: float) -> List[str]:
+        text = self.text + self.utf8.decode(data)
+        keys = []
+        i = 0
+        while i < len(text):
+            if text[i] != "\x1b":
+                keys.append(ui.ASCII_TO_NAME.get(text[i], text[i]))
+                i += 1
+                continue
+            end = escape_code_end(text, i)
+            if end is None:
+                if self.deadline is None:
+                    self.deadline = now + ESCAPE_TIMEOUT
+                if now < self.deadline:
+                    break
+                end = i + 1
+            self.deadline = None
+            code = text[i:end]
+            if code.startswith("\x1bO"):
+                code = "\x1b[" + code[2:]
+            keys.append(ui.ESCAPE_CODE_TO_NAME.get(code) or ui.ASCII_TO_NAME.get(code, code))
+            i = end
+        self.text = text[i:]
+        return keys
+
+class Writer:
+    # Writes frames to a file descriptor, which may be non-blocking, keeping
+    # whatever the terminal hasn't taken yet to write before the next frame
+    pending: memoryview
+
+    def __init__(self, fd: int = 1) -> None:
+        self.fd = fd
+        self.pending = memoryview(b"")
+
+    def flush(self) -> bool:
+        # write as much as possible without waiting, returning whether
+        # everything has been written
+        while self.pending:
+            try:
+                n = os.write(self.fd, self.pending)
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.pending = self.pending[n:]
+        return True
+
+    def write(self, data: bytes) -> bool:
+        self.pending = memoryview(data)
+        return self.flush()
+
+    def wait(self) -> None:
+        while not self.flush():
+            select.select([], [self.fd], [])
+
 class BeepSelection(menu.Button):
     def __init__(self, name: str, value: bool) -> None:
         self.name = [name]
@@ -78,16 +173,37 @@ class BaseTerminalUI(ui.UI):
     ]
     reset_code = "\x1b[0m"
     menus: List[ui.Menu]
+    keys: Deque[str]
+    output: List[str]
+    front: List[List[Cell]]
+    back: List[List[Cell]]
+    dirty_rows: Set[int]
+    cursor: Optional[Tuple[int, int]]
 
     def __init__(self) -> None:
         self.menus = []
+        self.keys = collections.deque()
+        self.decoder = KeyDecoder()
         self.fg_colour = ui.Colour.WHITE
         self.bg_colour = ui.Colour.BLACK
-        self.buffer = ""
+        self.output = []
+        self.writer = Writer()
+        self.frames_merged = 0 # updates put off until the terminal caught up
+        self.behind = False
         self.inital_options = None
         terminal_size = shutil.get_terminal_size()
         self.width = terminal_size.columns // 2
         self.height = terminal_size.lines
+        # cells drawn since the last update and cells on screen, so only
+        # changes are written
+        self.front = []
+        self.back = []
+        self.dirty_rows = set()
+        self.front_mode = -1
+        self.front_size = (0, 0)
+        self.cursor = None
+        self.frame_bytes = 0 # bytes written by the last update
+        self.bytes_written = 0
         self.mode_menu = menu.Menu([ModeSelection(mode) for mode in BaseTerminalUI.MODES])
         self.beep_menu = menu.Menu([
             BeepSelection("Enable", True),
@@ -121,21 +237,28 @@ class BaseTerminalUI(ui.UI):
             menu = self.menus[-1]
             if menu is not prev_menu:
                 menu.resize(self.width, self.height)
-            terminal_size = shutil.get_terminal_size()
-            width = terminal_size.columns // 2
-            height = terminal_size.lines
-            if width != self.width or height != self.height:
-                self.width = width
-                self.height = height
-                menu.resize(width, height)
-            if self.check_keyboard_and_wait(time_left):
-                menu.key(self.get_key())
+            if self.check_resized():
+                terminal_size = shutil.get_terminal_size()
+                width = terminal_size.columns // 2
+                height = terminal_size.lines
+                if width != self.width or height != self.height:
+                    self.width = width
+                    self.height = height
+                    menu.resize(width, height)
+            if self.keys or self.check_keyboard_and_wait(time_left):
+                # handle every key read, unless one changes the menu, which
+                # needs setting up before it gets the rest
+                self.keys.extend(self.read_keys())
+                while self.keys and self.menus and self.menus[-1] is menu:
+                    menu.key(self.keys.popleft())
             end_time = time.perf_counter()
             time_left -= end_time - start_time
             start_time = end_time
             while time_left < 0:
                 time_left += 1/tps
                 menu.tick()
+            if self.behind:
+                self.update_screen()
             prev_menu = menu
 
     def push_menu(self, menu: ui.Menu) -> None:
@@ -146,73 +269,149 @@ class BaseTerminalUI(ui.UI):
         self.menus.pop()
 
     def clear(self) -> None:
-        self.buffer += "\x1b[0m\x1b[2J\x1b[3J"
+        # clear the back buffer, so anything which isn't drawn again is
+        # erased on the next update
+        columns = 2 * self.width
+        self.back = [[BLANK] * columns for y in range(self.height)]
+        self.dirty_rows = set(range(self.height))
+
+    def put_cells(self, column: int, y: int, cells: List[Cell]) -> None:
+        if not 0 <= y < len(self.back):
+            return
+        row = self.back[y]
+        for i, cell in enumerate(cells, column):
+            if 0 <= i < len(row):
+                row[i] = cell
+        self.dirty_rows.add(y)
 
     def set_fg_colour(self, colour: ui.Colour) -> None:
         if colour != self.fg_colour:
             if colour == ui.Colour.WHITE:
-                self.buffer += TerminalUI.reset_code
+                self.output.append(TerminalUI.reset_code)
                 # set background colour again if resetting terminal for foreground
                 old_bg_colour = self.bg_colour
                 self.fg_colour = ui.Colour.WHITE
                 self.bg_colour = ui.Colour.BLACK
                 self.set_bg_colour(old_bg_colour)
             else:
-                self.buffer += TerminalUI.fg_colour_codes[self.mode_menu.current][colour]
+                self.output.append(TerminalUI.fg_colour_codes[self.mode_menu.current][colour])
                 self.fg_colour = colour
 
     def set_bg_colour(self, colour: ui.Colour) -> None:
         if colour != self.bg_colour:
             if colour == ui.Colour.BLACK:
-                self.buffer += TerminalUI.reset_code
+                self.output.append(TerminalUI.reset_code)
                 # set foreground colour again if resetting terminal for background
                 old_fg_colour = self.fg_colour
                 self.fg_colour = ui.Colour.WHITE
                 self.bg_colour = ui.Colour.BLACK
                 self.set_fg_colour(old_fg_colour)
             else:
-                self.buffer += TerminalUI.bg_colour_codes[self.mode_menu.current][colour]
+                self.output.append(TerminalUI.bg_colour_codes[self.mode_menu.current][colour])
                 self.bg_colour = colour
 
     def goto(self, x: float, y: float) -> None:
-        self.buffer += f"\x1b[{int(y+1)};{int(2*x+1)}H" # double x so pixels are approximately square
+        self.output.append(f"\x1b[{int(y+1)};{int(2*x+1)}H") # double x so pixels are approximately square
+        self.cursor = None
+
+    def goto_cell(self, column: int, y: int) -> None:
+        if self.cursor != (column, y):
+            self.output.append(f"\x1b[{y+1};{column+1}H")
+            self.cursor = (column, y)
 
     def draw_text(self, text: str, x: int, y: int, fg_colour: ui.Colour = ui.Colour.WHITE, bg_colour: ui.Colour = ui.Colour.BLACK, align: ui.Alignment = ui.Alignment.LEFT) -> None:
         if align == ui.Alignment.CENTER:
             offset = -len(text) / 4
         else:
             offset = 0
-        self.set_fg_colour(fg_colour)
-        self.set_bg_colour(bg_colour)
-        self.goto(x+offset, y)
-        self.buffer += text
+        # round the same way as goto, where x is doubled so pixels are approximately square
+        column = int(2*(x+offset)+1) - 1
+        self.put_cells(column, y, [BLANK if c == " " and bg_colour == ui.Colour.BLACK else (c, fg_colour, bg_colour) for c in text])
 
     def set_pixel(self, colour: ui.Colour, x: int, y: int) -> None:
-        self.goto(x, y)
         if self.mode_menu.current == 3 and colour == ui.Colour.LIGHT_GREY:
-            self.set_bg_colour(ui.Colour.BLACK)
-            self.buffer += "''"
+            cell = ("'", ui.Colour.WHITE, ui.Colour.BLACK)
         elif self.mode_menu.current == 3 and colour == ui.Colour.WHITE:
-            self.set_bg_colour(ui.Colour.BLACK)
-            self.buffer += "##"
+            cell = ("#", ui.Colour.WHITE, ui.Colour.BLACK)
         else:
-            self.set_bg_colour(colour)
-            self.buffer += "  "
+            cell = (" ", ui.Colour.WHITE, colour)
+        self.put_cells(2*x, y, [cell, cell])
 
     def beep(self) -> None:
         if self.beep_menu.current == 0:
-            self.buffer += "\x07"
+            self.output.append("\x07")
 
     def update_screen(self) -> None:
-        self.goto(0, 0)
-        sys.stdout.write(self.buffer)
-        sys.stdout.flush()
-        self.buffer = ""
+        if not self.writer.flush():
+            # the terminal hasn't finished taking the last frame, so leave
+            # changes in the back buffer to be merged into the next frame
+            if not self.behind:
+                self.frames_merged += 1
+            self.behind = True
+            return
+        self.behind = False
+        columns = 2 * self.width
+        if len(self.back) != self.height or any(len(row) != columns for row in self.back):
+            self.clear()
+        if self.front_mode != self.mode_menu.current or self.front_size != (columns, self.height):
+            # the screen is in an unknown state, so clear it and draw everything
+            self.output.append("\x1b[0m\x1b[2J\x1b[3J")
+            self.fg_colour = ui.Colour.WHITE
+            self.bg_colour = ui.Colour.BLACK
+            self.front = [[BLANK] * columns for y in range(self.height)]
+            self.dirty_rows = set(range(self.height))
+            self.front_mode = self.mode_menu.current
+            self.front_size = (columns, self.height)
+        output = self.output
+        for y in sorted(self.dirty_rows):
+            back_row = self.back[y]
+            front_row = self.front[y]
+            if back_row == front_row:
+                continue
+            x = 0
+            while x < columns:
+                if back_row[x] == front_row[x]:
+                    x += 1
+                    continue
+                # write changes in this row with a single cursor move, going
+                # over short gaps of unchanged cells
+                end = x + 1
+                i = end
+                while i < columns and i - end <= MAX_GAP:
+                    if back_row[i] != front_row[i]:
+                        end = i + 1
+                    i += 1
+                self.goto_cell(x, y)
+                for c, fg_colour, bg_colour in back_row[x:end]:
+                    if c != " ":
+                        self.set_fg_colour(fg_colour)
+                    self.set_bg_colour(bg_colour)
+                    output.append(c)
+                self.cursor = (end, y)
+                x = end
+            self.front[y] = list(back_row)
+        self.dirty_rows = set()
+        if output:
+            self.goto_cell(0, 0)
+            data = "".join(output).encode("utf8")
+            self.output = []
+            self.behind = not self.writer.write(data)
+            self.frame_bytes = len(data)
+            self.bytes_written += len(data)
+        else:
+            self.frame_bytes = 0
 
     def get_options_menu(self) -> menu.Menu:
         return self.options_menu
 
-    def get_key(self) -> str: raise NotImplementedError
+    def get_key(self) -> str:
+        while not self.keys:
+            if self.check_keyboard_and_wait(ESCAPE_TIMEOUT):
+                self.keys.extend(self.read_keys())
+        return self.keys.popleft()
+
+    def read_keys(self) -> List[str]: raise NotImplementedError
+    def check_resized(self) -> bool: raise NotImplementedError
     def detect_colour_mode(self) -> int: raise NotImplementedError
     def check_keyboard_and_wait(self, t: float) -> bool: raise NotImplementedError
 
@@ -229,48 +428,97 @@ if sys.platform == "win32":
             self.goto(0, 0)
             self.update_screen()
 
-        def get_key(self) -> str:
-            c = msvcrt.getch()
-            if c == b'\xe0' or c == b'\x00':
-                scancode = msvcrt.getch()[0]
-                s = f"Scancode{scancode}"
-                return SCANCODE_TO_NAME.get(scancode, s)
-            else:
-                s = chr(c[0])
-                return ui.ASCII_TO_NAME.get(s, s)
+        def read_keys(self) -> List[str]:
+            keys = []
+            while msvcrt.kbhit():
+                c = msvcrt.getch()
+                if c == b'\xe0' or c == b'\x00':
+                    scancode = msvcrt.getch()[0]
+                    s = f"Scancode{scancode}"
+                    keys.append(SCANCODE_TO_NAME.get(scancode, s))
+                else:
+                    s = chr(c[0])
+                    keys.append(ui.ASCII_TO_NAME.get(s, s))
+            return keys
 
         def detect_colour_mode(self) -> int:
             return 1
 
+        def check_resized(self) -> bool:
+            # there is no signal for resizing, so check the size every time
+            return True
+
         def check_keyboard_and_wait(self, t: float) -> bool:
             time.sleep(t)
             return msvcrt.kbhit()
 
 else:
-    import termios
+    import termios, signal
     class TerminalUI(BaseTerminalUI):
+        resize_pipe: Tuple[int, int]
+
         def init(self) -> None:
+            # a SIGWINCH handler notes when the terminal is resized, and
+            # writes to a pipe to wake up select right away
+            self.resized = False
+            self.resize_pipe = os.pipe()
+            for fd in self.resize_pipe:
+                os.set_blocking(fd, False)
+            self.initial_winch_handler = signal.signal(signal.SIGWINCH, self.on_resize)
             # update terminal options
             self.initial_options = termios.tcgetattr(0)
             custom_options = self.initial_options.copy()
             custom_options[3] &= ~termios.ECHO
             custom_options[3] &= ~termios.ICANON
             termios.tcsetattr(0, termios.TCSANOW, custom_options)
+            # write without blocking, so a slow terminal doesn't hold up the
+            # game, and make sure stdout is blocking again however the game exits
+            self.initial_blocking = os.get_blocking(1)
+            os.set_blocking(1, False)
+            atexit.register(self.restore_stdout)
+
+        def restore_stdout(self) -> None:
+            os.set_blocking(1, self.initial_blocking)
 
         def quit(self) -> None:
             # reset terminal options
             termios.tcsetattr(0, termios.TCSANOW, self.initial_options)
-            # reset terminal
-            self.set_fg_colour(ui.Colour.WHITE)
-            self.set_bg_colour(ui.Colour.BLACK)
-            self.goto(0, 0)
-            self.update_screen()
+            try:
+                # reset terminal
+                self.writer.wait()
+                self.set_fg_colour(ui.Colour.WHITE)
+                self.set_bg_colour(ui.Colour.BLACK)
+                self.goto(0, 0)
+                self.update_screen()
+                self.writer.wait()
+            finally:
+                self.restore_stdout()
+                atexit.unregister(self.restore_stdout)
+                signal.signal(signal.SIGWINCH, self.initial_winch_handler)
+                for fd in self.resize_pipe:
+                    os.close(fd)
+
+        def on_resize(self, signum: int, frame: Any) -> None:
+            self.resized = True
+            try:
+                os.write(self.resize_pipe[1], b"\0")
+            except BlockingIOError:
+                pass # already waiting to be read
+
+        def check_resized(self) -> bool:
+            resized = self.resized
+            self.resized = False
+            return resized
 
-        def get_key(self) -> str:
-            s = os.read(0, 100).decode("utf8")
-            if s in ui.ESCAPE_CODE_TO_NAME:
-                return ui.ESCAPE_CODE_TO_NAME[s];
-            return ui.ASCII_TO_NAME.get(s, s);
+        def read_keys(self) -> List[str]:
+            # read everything waiting without blocking
+            data = b""
+            while select.select([0], [], [], 0)[0]:
+                chunk = os.read(0, 1024)
+                if not chunk:
+                    break
+                data += chunk
+            return self.decoder.decode(data, time.perf_counter())
 
         def detect_colour_mode(self) -> int:
             terminal = os.environ.get("TERM", "")
@@ -283,5 +531,14 @@ else:
                 return 0
 
         def check_keyboard_and_wait(self, t: float) -> bool:
-            r, _, _ = select.select([0], [], [], t)
-            return len(r) != 0
+            # also stop waiting when an escape has waited long enough to be the Escape key
+            deadline = self.decoder.deadline
+            if deadline is not None:
+                t = max(0, min(t, deadline - time.perf_counter()))
+            r, _, _ = select.select([0, self.resize_pipe[0]], [], [], t)
+            if self.resize_pipe[0] in r:
+                try:
+                    os.read(self.resize_pipe[0], 1024)
+                except BlockingIOError:
+                    pass
+            return len(r) != 0 or deadline is not None
@@ -1,5 +1,5 @@
 import enum
-from typing import Collection, Union
+from typing import Collection, Union, Sequence, Tuple
 
 class Colour(enum.Enum):
     BLACK      = 0
@@ -56,6 +56,10 @@ ESCAPE_CODE_TO_NAME = {
     "\x1b[6~": "Page Down",
 }
 
+# repeat count for auto repeat with no delay, which repeats as far as the key goes
+INSTANT_REPEAT = -1
+MAX_INSTANT_REPEATS = 16
+
 class Menu:
     def init(self, ui: "UI") -> None: raise NotImplementedError
     def tick(self) -> None: raise NotImplementedError
@@ -63,9 +67,20 @@ class Menu:
     def resize(self, width: int, height: int) -> None: raise NotImplementedError
     def enable_custom_handling(self) -> bool: raise NotImplementedError
 
+    def keys(self, presses: Sequence[Tuple[str, int]]) -> None:
+        # every key press in a tick, as the key and how many times it repeats,
+        # with 0 for the first press
+        for c, repeats in presses:
+            if repeats == 0:
+                self.key(c)
+            else:
+                for i in range(MAX_INSTANT_REPEATS if repeats == INSTANT_REPEAT else repeats):
+                    self.key(c, repeated=True)
+
 class UI:
     width: int
     height: int
+    headless = False # set when nothing is displayed, so games can skip drawing
     def init(self) -> None: raise NotImplementedError
     def quit(self) -> None: raise NotImplementedError
     def draw_text(self, text: str, x: int, y: int, fg_colour: Colour = Colour.WHITE, bg_colour: Colour = Colour.BLACK, align: Alignment = Alignment.LEFT) -> None: raise NotImplementedError